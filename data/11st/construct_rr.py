@@ -4,41 +4,89 @@
 Convert Korean datasets to Revised Romanization of Korean (RR, MC2000)
 Copyright 2016 Xiang Zhang
 
-Usage: python3 construct_hepburn.py -i [input] -o [output]
+Usage: python3 construct_rr.py -i [input] -o [output] [-f] [-c]
+    [-w workers] [--resume]
 '''
 
 # Input file
 INPUT = '../data/11st/sentiment/full_train.csv'
 # Output file
 OUTPUT = '../data/11st/sentiment/full_train_rr.csv'
+# Use precomputed romanization table
+FAST = False
+# Check precomputed romanization table against the transliterator
+CHECK = False
+# Number of worker processes
+WORKERS = 1
+# Resume from the checkpoint of output
+RESUME = False
+# Maximum number of words in the romanization cache
+CACHE_SIZE = 1048576
+# Number of rows converted in this process
+LINE = 0
+# Number of fields mismatched in check mode
+MISMATCHES = 0
+# Romanization of Hangul syllables
+TABLE = None
+# Whether a syllable is marked by its initial and the previous final
+MARKS = None
+# Set of Hanja characters
+HANJA = None
 
 import argparse
-import csv
+import functools
 import hanja
-import unidecode
+import hanja.table
+import runner
+import transliteration
 
 # Hangul romanization libraries
 from hangul_romanize import Transliter
+from hangul_romanize.core import Syllable
 from hangul_romanize.rule import academic
 
 # Main program
 def main():
     global INPUT
     global OUTPUT
+    global FAST
+    global CHECK
+    global WORKERS
+    global RESUME
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help = 'Input file', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-f', '--fast', help = 'Use precomputed romanization table',
+        action = 'store_true')
+    parser.add_argument(
+        '-c', '--check', help = 'Check romanization table against the '
+        'transliterator', action = 'store_true')
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes',
+        type = int, default = WORKERS)
+    parser.add_argument(
+        '--resume', help = 'Resume from checkpoint of output',
+        action = 'store_true')
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    FAST = args.fast
+    CHECK = args.check
+    WORKERS = args.workers
+    RESUME = args.resume
 
-    transliter = Transliter(academic)
+    if CHECK and WORKERS > 1:
+        parser.error('argument -c/--check: not allowed with argument '
+                     '-w/--workers')
 
-    convertRoman(transliter)
+    if FAST or CHECK:
+        print('Building romanization table')
+    convertRoman()
 
 def romanizeText(transliter, text):
     text = text.strip()
@@ -47,26 +95,120 @@ def romanizeText(transliter, text):
         return transliter.translit(hangul_text)
     return text
 
+# Build the romanization table of Hangul syllables from the rule
+#
+# The rule is applied to each syllable alone, and to each pair of previous
+# final and initial to find where a hyphen marker is put. If the rule does
+# anything else with its neighbours, the table is not used.
+def buildTable(transliter):
+    global TABLE
+    global MARKS
+    global HANJA
+
+    HANJA = frozenset(hanja.table.hanja_table)
+    table = list()
+    for code in range(Syllable.MIN, Syllable.MAX + 1):
+        table.append(transliter.rule(
+            (chr(code), Syllable(code = code)), pre = (None, None),
+            post = (None, None)))
+    marks = list()
+    for final in range(28):
+        pre_code = Syllable.MIN + final
+        for initial in range(19):
+            code = Syllable.MIN + initial * 588
+            result = transliter.rule(
+                (chr(code), Syllable(code = code)),
+                pre = (chr(pre_code), Syllable(code = pre_code)),
+                post = (None, None))
+            if result == '-' + table[code - Syllable.MIN]:
+                marks.append(True)
+            elif result == table[code - Syllable.MIN]:
+                marks.append(False)
+            else:
+                print('Romanization rule not supported by table')
+                return
+    TABLE = table
+    MARKS = marks
+
+# Create the RR view of text fields for segment_word.py
+def createView():
+    transliter = Transliter(academic)
+    buildTable(transliter)
+    return lambda text: transliteration.unidecode(tableRomanizeText(
+        transliter, text)).strip().replace('\n','\\n')
+
+# Romanize text using the table, or the transliterator if not supported
+def tableRomanizeText(transliter, text):
+    text = text.strip()
+    if text != '':
+        # Skip Hanja translation for text without Hanja
+        if HANJA.isdisjoint(text):
+            hangul_text = text
+        else:
+            hangul_text = hanja.translate(text, 'substitution')
+        if TABLE is None:
+            return transliter.translit(hangul_text)
+        # Words separated by spaces do not affect each other
+        return ' '.join(map(romanizeWord, hangul_text.split(' ')))
+    return text
+
+# Romanize a word using the table with the romanization cache
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def romanizeWord(word):
+    result = list()
+    # Final of the previous character, or None if it is not a syllable
+    final = None
+    for character in word:
+        index = ord(character) - Syllable.MIN
+        if 0 <= index < len(TABLE):
+            if final is not None and MARKS[final * 19 + index // 588]:
+                result.append('-')
+            result.append(TABLE[index])
+            final = index % 28
+        else:
+            result.append(character)
+            final = None
+    return ''.join(result)
+
 # Convert the text in Chinese to pintin
-def convertRoman(transliter):
-    # Open the files
-    ifd = open(INPUT, encoding = 'utf-8', newline = '')
-    ofd = open(OUTPUT, 'w', encoding = 'utf-8', newline = '')
-    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Loop over the csv rows
-    n = 0
-    for row in reader:
-        new_row = list()
-        new_row.append(row[0])
-        for i in range(1, len(row)):
-            new_row.append(unidecode.unidecode(romanizeText(
-                        transliter, row[i])).strip().replace('\n','\\n'))
-        writer.writerow(new_row)
-        n = n + 1
-        if n % 1000 == 0:
-            print('\rProcessing line: {}'.format(n), end = '')
-    print('\rProcessed lines: {}'.format(n))
+def convertRoman():
+    runner.run(INPUT, OUTPUT, functools.partial(
+        createConverter, FAST, CHECK), WORKERS, RESUME)
+    if CHECK:
+        print('Mismatched fields: {}'.format(MISMATCHES))
+    # Caches of worker processes are not reported
+    if WORKERS <= 1:
+        transliteration.report()
+
+# Create the row converter in a process
+def createConverter(fast, check):
+    global FAST
+    global CHECK
+    FAST = fast
+    CHECK = check
+    transliter = Transliter(academic)
+    if FAST or CHECK:
+        buildTable(transliter)
+    return functools.partial(convertRow, transliter)
+
+# Convert a csv row with text in Korean to RR romanization
+def convertRow(transliter, row):
+    global LINE
+    global MISMATCHES
+    LINE = LINE + 1
+    new_row = list()
+    new_row.append(row[0])
+    for i in range(1, len(row)):
+        if FAST and not CHECK:
+            text = tableRomanizeText(transliter, row[i])
+        else:
+            text = romanizeText(transliter, row[i])
+        if CHECK and tableRomanizeText(transliter, row[i]) != text:
+            MISMATCHES = MISMATCHES + 1
+            print('\rMismatch at line {} field {}'.format(LINE, i))
+        new_row.append(transliteration.unidecode(
+            text).strip().replace('\n','\\n'))
+    return new_row
 
 if __name__ == '__main__':
     main()
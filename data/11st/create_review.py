@@ -5,61 +5,86 @@ Create data from list of LZMA compressed archives of reviews
 Copyright 2016 Xiang Zhang
 
 Usage: python3 create_review.py -i [input file pattern] -o [output file]
+    [-w workers] [--shards shards]
+    [--compress method]
 '''
 
 import argparse
-import csv
 import glob
-import json
 import lzma
+import records
+import sharding
 
 INPUT = '../data/11st/review/*.json.xz'
 OUTPUT = '../data/11st/sentiment/review.csv'
+WORKERS = 1
+SHARDS = None
+COMPRESS = None
 
 def main():
     global INPUT
     global OUTPUT
+    global WORKERS
+    global SHARDS
+    global COMPRESS
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-i', '--input', help = 'Input file pattern', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes', type = int,
+        default = WORKERS)
+    parser.add_argument(
+        '--shards', help = 'Number of output shards', type = int,
+        default = SHARDS)
+    parser.add_argument(
+        '--compress', help = 'Compression of output files',
+        choices = sorted(sharding.COMPRESSORS), default = COMPRESS)
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    WORKERS = args.workers
+    SHARDS = args.shards
+    COMPRESS = args.compress
 
     createData()
 
 def createData():
-    # Open the output file
-    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Grab the files
-    files = glob.glob(INPUT)
+    # Open the output file, or its shards
+    writer = sharding.ShardWriter(OUTPUT, SHARDS, COMPRESS)
+    # Grab the files in sorted order so that the output is deterministic
+    files = sorted(glob.glob(INPUT))
     n = 0
     filecount = 0
-    for filename in files:
+    # Decompress and parse the files in worker processes if any, in order
+    for filename, rows in records.readFiles(readRows, files, WORKERS):
         filecount = filecount + 1
         print('Processing file {}/{}: {}. Processed items {}.'.format(
                 filecount, len(files), filename, n))
         try:
-            ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
-            for line in ifd:
-                review = json.loads(line)
-                star = review.get('star', '')
-                title = review.get('title', '')
-                content = review.get('content', '')
-                if star != '':
-                    n = n + 1
-                    writer.writerow([star, title.replace('\n', '\\n'),
-                                     content.replace('\n', '\\n')])
-            ifd.close()
+            for row in rows:
+                writer.writerow(row)
+                n = n + 1
         except Exception as e:
             print('Exception (ignored): {}'.format(e))
-    ofd.close()
+    writer.close()
+
+# Read the rows of a file
+def readRows(filename):
+    ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
+    for line in ifd:
+        review = records.loads(line)
+        star = review.get('star', '')
+        title = review.get('title', '')
+        content = review.get('content', '')
+        if star != '':
+            yield [star, title.replace('\n', '\\n'),
+                   content.replace('\n', '\\n')]
+    ifd.close()
 
 if __name__ == '__main__':
     main()
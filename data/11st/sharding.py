@@ -0,0 +1 @@
+../dianping/sharding.py
\ No newline at end of file
@@ -0,0 +1 @@
+../dianping/shuffle_lines.py
\ No newline at end of file
@@ -5,36 +5,66 @@ Create data from list of LZMA compressed archives of news articles
 Copyright 2016 Xiang Zhang
 
 Usage: python3 construct_topic.py -i [input directory] -o [output file]
+    [-w workers] [-s summary file] [--shards shards]
+    [--compress method]
 '''
 
 import argparse
 import csv
-import glob
 import json
 import lzma
+import os
+import records
+import sharding
 
 INPUT = '../data/chinanews/article'
 OUTPUT = '../data/chinanews/topic/news.csv'
 CATEGORY_FILE = '../data/chinanews/category/category.json'
+SUMMARY = None
+WORKERS = 1
+SHARDS = None
+COMPRESS = None
+# Fields of articles decoded, with only the first paragraph of content
+FIELDS = {'title': None, 'content': 1}
 
 def main():
     global INPUT
     global OUTPUT
+    global WORKERS
+    global SHARDS
+    global COMPRESS
     global CATEGORY_FILE
+    global SUMMARY
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-i', '--input', help = 'Input file directory', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes', type = int,
+        default = WORKERS)
     parser.add_argument(
         '-c', '--category', help = 'Category file', default = CATEGORY_FILE)
+    parser.add_argument(
+        '-s', '--summary', help = 'Summary file of raw item counts',
+        default = SUMMARY)
+    parser.add_argument(
+        '--shards', help = 'Number of output shards', type = int,
+        default = SHARDS)
+    parser.add_argument(
+        '--compress', help = 'Compression of output files',
+        choices = sorted(sharding.COMPRESSORS), default = COMPRESS)
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    WORKERS = args.workers
+    SHARDS = args.shards
+    COMPRESS = args.compress
     CATEGORY_FILE = args.category
+    SUMMARY = args.summary
 
     createData()
 
@@ -47,35 +77,89 @@ def createData():
         category = json.loads(line)
         classes[category['code']] = i
         i = i + 1
-    # Open the output file
-    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Grab the files
+    # Index the files of all categories in a single scan of the directory
+    files = indexFiles(classes)
+    # Open the output file, or its shards
+    writer = sharding.ShardWriter(OUTPUT, SHARDS, COMPRESS)
+    # Files of all categories in category order, so that workers keep busy
+    # across categories while the rows are written in order
+    jobs = [(classes[prefix], filename)
+            for prefix in classes for filename in files[prefix]]
+    # Decompress and parse the files in worker processes if any, in order
+    results = records.readFiles(readRows, jobs, WORKERS)
+    counts = dict()
     for prefix in classes:
-        files = glob.glob(INPUT + '/' + prefix + '_*.json.xz')
-        index = classes[prefix]
         n = 0
         filecount = 0
-        for filename in files:
+        for i in range(len(files[prefix])):
+            (index, filename), rows = next(results)
             filecount = filecount + 1
             print('Processing file {}/{}: {}. Processed items {}.'.format(
-                    filecount, len(files), filename, n))
+                    filecount, len(files[prefix]), filename, n))
             try:
-                ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
-                for line in ifd:
-                    news = json.loads(line)
-                    title = news.get('title', '')
-                    content = news.get('content', list())
-                    abstract = ''
-                    if len(content) > 0:
-                        abstract = content[0]
+                for row in rows:
+                    writer.writerow(row)
                     n = n + 1
-                    writer.writerow([index, title.replace('\n', '\\n'),
-                                     abstract.replace('\n', '\\n')])
-                ifd.close()
             except Exception as e:
                 print('Exception (ignored): {}'.format(e))
+        counts[prefix] = n
+    # Finish the generator so that the worker processes are joined
+    for job in results:
+        pass
+    writer.close()
+    for prefix in classes:
+        print('Category {}: {}. Items {}.'.format(
+            classes[prefix], prefix, counts[prefix]))
+    if SUMMARY:
+        writeSummary(classes, counts)
+
+# Index the sorted files of each category by the prefix of their names
+#
+# A file belongs to a category if its name is the code of the category, an
+# underscore and anything ending with '.json.xz', the same as the pattern
+# used for each category before.
+def indexFiles(classes):
+    files = dict((prefix, list()) for prefix in classes)
+    for entry in os.scandir(INPUT):
+        name = entry.name
+        if name.startswith('.') or not name.endswith('.json.xz'):
+            continue
+        # Codes of categories could include underscores
+        end = name.find('_')
+        while end != -1 and end < len(name) - len('.json.xz'):
+            if name[:end] in files:
+                files[name[:end]].append(INPUT + '/' + name)
+            end = name.find('_', end + 1)
+    for prefix in files:
+        files[prefix].sort()
+    return files
+
+# Write the raw item counts of categories in the output
+#
+# Each row is class, category code and number of items. The counts are of
+# the output before removing null and duplicated items, so they are not the
+# counts of the input to select_data.lua.
+def writeSummary(classes, counts):
+    ofd = open(SUMMARY, 'w', newline = '', encoding = 'utf-8')
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    for prefix in classes:
+        writer.writerow([classes[prefix], prefix, counts[prefix]])
     ofd.close()
 
+# Read the rows of the file of a job
+def readRows(job):
+    index, filename = job
+    ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
+    for line in ifd:
+        news = records.loads(line, FIELDS)
+        title = news.get('title', '')
+        content = news.get('content', list())
+        abstract = ''
+        if len(content) > 0:
+            abstract = content[0]
+        yield [index, title.replace('\n', '\\n'),
+               abstract.replace('\n', '\\n')]
+    ifd.close()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1 @@
+../dianping/records.py
\ No newline at end of file
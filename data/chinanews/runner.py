@@ -0,0 +1 @@
+../dianping/runner.py
\ No newline at end of file
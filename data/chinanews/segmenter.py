@@ -0,0 +1 @@
+../dianping/segmenter.py
\ No newline at end of file
@@ -4,60 +4,201 @@
 Convert Chinese datasets to Pinyin format
 Copyright 2016 Xiang Zhang
 
-Usage: python3 construct_pinyin.py -i [input] -o [output]
+Usage: python3 construct_pinyin.py -i [input] -o [output] [-f] [-c]
+    [-w workers] [--resume]
 '''
 
 #Input file
 INPUT = '../data/dianping/train.csv'
 #Output file
 OUTPUT = '../data/dianping/train_pinyin.csv'
+# Use precomputed pinyin table
+FAST = False
+# Check precomputed pinyin table against pypinyin
+CHECK = False
+# Number of worker processes
+WORKERS = 1
+# Resume from the checkpoint of output
+RESUME = False
+# Number of rows converted in this process
+LINE = 0
+# Number of fields mismatched in check mode
+MISMATCHES = 0
+# Pinyin of characters
+TABLE = None
+# Pinyin of phrases different from the pinyin of their characters
+PHRASES = None
+# Lengths of phrases in PHRASES by their first character
+PHRASE_LENGTHS = None
+# Regular expression to split text to runs of Chinese characters
+HANS = None
 
 import argparse
-import csv
+import functools
 import pypinyin
-import unidecode
+import pypinyin.constants
+import pypinyin.seg.mmseg
+import pypinyin.style
+import re
+import runner
+import transliteration
 
 # Main program
 def main():
     global INPUT
     global OUTPUT
+    global FAST
+    global CHECK
+    global WORKERS
+    global RESUME
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help = 'Input file', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-f', '--fast', help = 'Use precomputed pinyin table',
+        action = 'store_true')
+    parser.add_argument(
+        '-c', '--check', help = 'Check pinyin table against pypinyin',
+        action = 'store_true')
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes',
+        type = int, default = WORKERS)
+    parser.add_argument(
+        '--resume', help = 'Resume from checkpoint of output',
+        action = 'store_true')
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    FAST = args.fast
+    CHECK = args.check
+    WORKERS = args.workers
+    RESUME = args.resume
 
+    if CHECK and WORKERS > 1:
+        parser.error('argument -c/--check: not allowed with argument '
+                     '-w/--workers')
+
+    if FAST or CHECK:
+        print('Building pinyin table')
     convertPinyin()
 
 # Convert the text in Chinese to pintin
 def convertPinyin():
-    # Open the files
-    ifd = open(INPUT, encoding = 'utf-8', newline = '')
-    ofd = open(OUTPUT, 'w', encoding = 'utf-8', newline = '')
-    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Loop over the csv rows
-    n = 0
-    for row in reader:
-        new_row = list()
-        new_row.append(row[0])
-        for i in range(1, len(row)):
-            new_row.append(' '.join(map(
-                str.strip,
-                map(lambda s: s.replace('\n', '\\n'),
-                    map(unidecode.unidecode,
-                        pypinyin.lazy_pinyin(
-                            row[i], style = pypinyin.TONE2))))))
-        writer.writerow(new_row)
-        n = n + 1
-        if n % 1000 == 0:
-            print('\rProcessing line: {}'.format(n), end = '')
-    print('\rProcessed lines: {}'.format(n))
+    runner.run(INPUT, OUTPUT, functools.partial(
+        createConverter, FAST, CHECK), WORKERS, RESUME)
+    # Caches of worker processes are not reported
+    if WORKERS <= 1:
+        transliteration.report()
+    if CHECK:
+        print('Mismatched fields: {}'.format(MISMATCHES))
+
+# Create the row converter in a process
+def createConverter(fast, check):
+    global FAST
+    global CHECK
+    FAST = fast
+    CHECK = check
+    if FAST or CHECK:
+        buildTable()
+    return convertRow
+
+# Convert a csv row with text in Chinese to pinyin
+def convertRow(row):
+    global LINE
+    global MISMATCHES
+    LINE = LINE + 1
+    new_row = list()
+    new_row.append(row[0])
+    for i in range(1, len(row)):
+        if FAST and not CHECK:
+            new_row.append(tablePinyin(row[i]))
+            continue
+        new_row.append(' '.join(map(
+            str.strip,
+            map(lambda s: s.replace('\n', '\\n'),
+                map(transliteration.unidecode,
+                    pypinyin.lazy_pinyin(
+                        row[i], style = pypinyin.TONE2))))))
+        if CHECK and tablePinyin(row[i]) != new_row[-1]:
+            MISMATCHES = MISMATCHES + 1
+            print('\rMismatch at line {} field {}'.format(LINE, i))
+    return new_row
+
+# Convert a piece of pypinyin output to ascii
+def convertPiece(piece):
+    return transliteration.unidecode(piece).replace('\n', '\\n').strip()
+
+# Convert the pinyin of a word character by character
+def convertCharacters(word):
+    pinyin = list()
+    for character in word:
+        if character not in TABLE:
+            # Characters without pinyin are kept as themselves
+            TABLE[character] = ' '.join(map(convertPiece, pypinyin.lazy_pinyin(
+                character, style = pypinyin.TONE2)))
+        pinyin.append(TABLE[character])
+    return ' '.join(pinyin)
+
+# Build the pinyin table of characters and phrases
+#
+# pypinyin segments runs of Chinese characters by forward maximum matching
+# against its phrase dictionary and reads each phrase from the dictionary.
+# Only phrases read differently from their characters are kept, and runs
+# without any of them are converted character by character.
+def buildTable():
+    global TABLE
+    global PHRASES
+    global PHRASE_LENGTHS
+    global HANS
+
+    # The first reading is used as in pypinyin.lazy_pinyin
+    TABLE = dict()
+    for code, readings in pypinyin.constants.PINYIN_DICT.items():
+        TABLE[chr(code)] = convertPiece(pypinyin.style.convert(
+            readings.split(',')[0], pypinyin.TONE2, True))
+    PHRASES = dict()
+    PHRASE_LENGTHS = dict()
+    for phrase, readings in pypinyin.constants.PHRASES_DICT.items():
+        pinyin = ' '.join(convertPiece(pypinyin.style.convert(
+            reading[0], pypinyin.TONE2, True)) for reading in readings)
+        if pinyin != convertCharacters(phrase):
+            PHRASES[phrase] = pinyin
+            PHRASE_LENGTHS.setdefault(phrase[0], set()).add(len(phrase))
+    # RE_HANS matches a whole string of Chinese characters
+    HANS = re.compile(
+        '(' + pypinyin.constants.RE_HANS.pattern.lstrip('^').rstrip('$') + ')')
+
+# Create the pinyin view of text fields for segment_word.py
+def createView():
+    buildTable()
+    return tablePinyin
+
+# Convert a text field to pinyin using the table
+def tablePinyin(field):
+    pinyin = list()
+    # Runs of Chinese characters are at odd positions
+    runs = HANS.split(field)
+    for i in range(len(runs)):
+        if i % 2 == 1:
+            pinyin.append(tableRun(runs[i]))
+        elif len(runs[i]) > 0:
+            pinyin.append(convertPiece(runs[i]))
+    return ' '.join(pinyin)
+
+# Convert a run of Chinese characters to pinyin using the table
+def tableRun(run):
+    for i in range(len(run)):
+        for length in PHRASE_LENGTHS.get(run[i], ()):
+            if run[i:i + length] in PHRASES:
+                return ' '.join(
+                    PHRASES[word] if word in PHRASES
+                    else convertCharacters(word)
+                    for word in pypinyin.seg.mmseg.seg.cut(run))
+    return convertCharacters(run)
 
 if __name__ == '__main__':
     main()
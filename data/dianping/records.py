@@ -0,0 +1,139 @@
+'''
+Decoding of JSON records for the archive ingestion scripts
+Copyright 2016 Xiang Zhang
+
+Usage: import records; records.loads(line, fields)
+    records.readFiles(read, jobs, workers)
+'''
+
+import functools
+import json
+import json.decoder
+import runner
+
+# Use orjson for decoding whole records if it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Decoder for the values of records
+DECODER = json.JSONDecoder()
+# Regular expression to skip whitespace between tokens
+WHITESPACE = json.decoder.WHITESPACE
+
+# Decode a JSON record from a line, projected to the given fields
+#
+# The fields map each key to the number of leading list elements needed,
+# or None for the whole value, so that {'title': None, 'content': 1} gives
+# the title and content[:1] of an article. Keys not in the record are not
+# in the result. Skipping the rest of a list is faster than decoding the
+# whole record even with orjson, which is used for the other records.
+# Malformed lines raise the same errors as json.loads, except that the text
+# after the last field of a projection is not checked.
+def loads(line, fields = None):
+    if fields is not None and any(
+            count is not None for count in fields.values()):
+        try:
+            return project(line, fields)
+        except (IndexError, ValueError):
+            return json.loads(line)
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # Let the standard library decide on what orjson is strict about
+            return json.loads(line)
+    return json.loads(line)
+
+# Decode the fields of a JSON object, stopping once all of them are decoded
+def project(line, fields):
+    match = WHITESPACE.match
+    scanstring = json.decoder.scanstring
+    decode = DECODER.raw_decode
+    record = dict()
+    i = match(line, 0).end()
+    if line[i] != '{':
+        return json.loads(line)
+    i = match(line, i + 1).end()
+    if line[i] == '}':
+        return record
+    while True:
+        if line[i] != '"':
+            raise ValueError('Expecting property name')
+        key, i = scanstring(line, i + 1)
+        i = match(line, i).end()
+        if line[i] != ':':
+            raise ValueError('Expecting colon')
+        i = match(line, i + 1).end()
+        count = fields.get(key)
+        if count is not None and line[i] == '[':
+            # The rest of the list is skipped if this is the last field
+            last = len(record) + 1 == len(fields) and key not in record
+            value, i = decodeList(line, i, count, last)
+        else:
+            value, i = decode(line, i)
+        if key in fields:
+            record[key] = value
+            if i is None or len(record) == len(fields):
+                return record
+        i = match(line, i).end()
+        if line[i] == '}':
+            return record
+        if line[i] != ',':
+            raise ValueError('Expecting comma')
+        i = match(line, i + 1).end()
+
+# Decode the leading elements of a JSON list, with end None if not scanned
+def decodeList(line, i, count, last):
+    match = WHITESPACE.match
+    values = list()
+    i = match(line, i + 1).end()
+    if line[i] == ']':
+        return values, i + 1
+    while True:
+        if last and len(values) == count:
+            return values, None
+        value, i = DECODER.raw_decode(line, i)
+        if len(values) < count:
+            values.append(value)
+        i = match(line, i).end()
+        if line[i] == ']':
+            return values, i + 1
+        if line[i] != ',':
+            raise ValueError('Expecting comma')
+        i = match(line, i + 1).end()
+
+# Read the rows of files in order, in worker processes if more than 1
+#
+# The generator read(job) gives the rows of the file of a job, and each job
+# is given with a generator of its rows. In a single process the rows are
+# read as they are used. Worker processes read whole files, with at most 2
+# files per worker in flight. An exception that stops reading a file is
+# raised after the rows read before it.
+def readFiles(read, jobs, workers = 1):
+    if workers <= 1:
+        for job in jobs:
+            yield job, read(job)
+        return
+    for job, (rows, error) in runner.mapChunks(
+            functools.partial(readAll, read), ((job, job) for job in jobs),
+            workers):
+        yield job, replayRows(rows, error)
+
+# Read all rows of a job, with the exception that stopped reading if any
+def readAll(read, job):
+    rows = list()
+    try:
+        for row in read(job):
+            rows.append(row)
+    except Exception as e:
+        return rows, str(e)
+    return rows, None
+
+# Give the rows read in a worker process, raising its exception if any
+def replayRows(rows, error):
+    for row in rows:
+        yield row
+    if error is not None:
+        raise RuntimeError(error)
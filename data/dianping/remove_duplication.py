@@ -4,7 +4,9 @@
 Remove duplication from csv format file
 Copyright 2015 Xiang Zhang
 
-Usage: python3 remove_duplication.py -i [input] -o [output]
+Usage: python3 remove_duplication.py -i [input] -o [output] [-d digest]
+    [--verify] [--near threshold] [--shingle length]
+    [--permutations number] [-p partitions] [-w workers]
 '''
 
 # Python 3 compatibility
@@ -17,26 +19,104 @@ from __future__ import unicode_literals
 INPUT = '../data/dianping/reviews_nonull.csv'
 # Output file
 OUTPUT = '../data/dianping/reviews_nodup.csv'
+# Digest algorithm for storing texts as 128-bit digests
+DIGEST = None
+# Verify texts of equal digests against the input
+VERIFY = False
+# Jaccard similarity threshold for removing near duplicates
+NEAR = None
+# Number of characters in a shingle of text
+SHINGLE = 3
+# Number of MinHash permutations
+PERMUTATIONS = 64
+# Number of rows in a batch of MinHash signatures
+BATCH = 10000
+# Number of partitions of rows on disk by hash of text
+PARTITIONS = None
+# Number of worker processes to deduplicate partitions
+WORKERS = 1
 
 import argparse
+import array
 import csv
+import hashlib
+import heapq
+import multiprocessing
+import os
+import runner
+import shutil
+import tempfile
+import zlib
 
 # Main program
 def main():
     global INPUT
     global OUTPUT
+    global DIGEST
+    global VERIFY
+    global NEAR
+    global SHINGLE
+    global PERMUTATIONS
+    global PARTITIONS
+    global WORKERS
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help = 'Input file', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-d', '--digest', help = 'Digest algorithm for storing texts',
+        choices = sorted(hashlib.algorithms_guaranteed), default = DIGEST)
+    parser.add_argument(
+        '--verify', help = 'Verify texts of equal digests against input',
+        action = 'store_true')
+    parser.add_argument(
+        '--near', help = 'Jaccard similarity threshold of near duplicates',
+        type = float, default = NEAR)
+    parser.add_argument(
+        '--shingle', help = 'Number of characters in a shingle', type = int,
+        default = SHINGLE)
+    parser.add_argument(
+        '--permutations', help = 'Number of MinHash permutations', type = int,
+        default = PERMUTATIONS)
+    parser.add_argument(
+        '-p', '--partitions', help = 'Number of partitions on disk', type = int,
+        default = PARTITIONS)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes', type = int,
+        default = WORKERS)
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    DIGEST = args.digest
+    VERIFY = args.verify
+    NEAR = args.near
+    SHINGLE = args.shingle
+    PERMUTATIONS = args.permutations
+    PARTITIONS = args.partitions
+    WORKERS = args.workers
+
+    if VERIFY and not DIGEST:
+        parser.error('argument --verify: requires argument -d/--digest')
+    if NEAR is not None and DIGEST:
+        parser.error('argument --near: not allowed with argument -d/--digest')
+    if PARTITIONS and (NEAR is not None or VERIFY):
+        parser.error('argument -p/--partitions: not allowed with argument '
+                     '--near or --verify')
+    if WORKERS > 1 and not PARTITIONS:
+        parser.error('argument -w/--workers: requires argument '
+                     '-p/--partitions')
 
-    removeDuplicate()
+    if PARTITIONS:
+        removePartitioned()
+    elif NEAR is not None:
+        removeNear()
+    elif DIGEST:
+        removeDigest()
+    else:
+        removeDuplicate()
 
 # Deduplicate the text using python set
 def removeDuplicate():
@@ -60,5 +140,468 @@ def removeDuplicate():
             print('\rProcessing line: {}, valid: {}'.format(n, valid), end = '')
     print('\rProcessed lines: {}, valid: {}'.format(n, valid))
 
+# Deduplicate the text using a table of digests
+def removeDigest():
+    # Open the files, keeping input offsets of rows to verify their texts
+    vfd = None
+    if VERIFY:
+        ifd = runner.LineReader(INPUT)
+        vfd = open(INPUT, 'rb')
+    else:
+        ifd = open(INPUT, newline = '', encoding = 'utf-8')
+    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    digest = createDigest(DIGEST)
+    table = DigestTable(VERIFY)
+    # Loop over the csv rows
+    n = 0
+    valid = 0
+    offset = 0
+    for row in reader:
+        line = ' '.join(row[1:])
+        n = n + 1
+        same = None
+        if VERIFY:
+            same = lambda first: readText(vfd, first) == line
+        if table.add(digest(line.encode('utf-8')), offset, same):
+            valid = valid + 1
+            writer.writerow(row)
+        if VERIFY:
+            offset = ifd.offset
+        if n % 10000 == 0:
+            print('\rProcessing line: {}, valid: {}'.format(n, valid), end = '')
+    print('\rProcessed lines: {}, valid: {}'.format(n, valid))
+    if VERIFY:
+        print('Texts with colliding digests: {}'.format(table.collisions))
+    ifd.close()
+    ofd.close()
+    if vfd:
+        vfd.close()
+
+# Create the function of 128-bit digest of bytes for a hashlib algorithm
+def createDigest(algorithm):
+    constructor = getattr(hashlib, algorithm)
+    if algorithm.startswith('blake2'):
+        return lambda data: constructor(data, digest_size = 16).digest()
+    if algorithm.startswith('shake'):
+        return lambda data: constructor(data).digest(16)
+    return lambda data: constructor(data).digest()[:16]
+
+# Read the text of the row at an offset of the input
+def readText(fd, offset):
+    fd.seek(offset)
+    def readLines():
+        line = fd.readline()
+        while line:
+            yield line.decode('utf-8')
+            line = fd.readline()
+    row = next(csv.reader(readLines(), quoting = csv.QUOTE_ALL))
+    return ' '.join(row[1:])
+
+# Open addressing hash table of 128-bit digests
+#
+# Slots are 16 bytes each in one bytearray, and a zero digest marks an
+# empty slot. The table doubles when it is half full. In verify mode, the
+# input offset of the row of each digest is also kept, so that rows with
+# an equal digest are compared by their texts and colliding texts occupy
+# different slots. The collisions are the number of distinct texts added
+# with the digest of an earlier different text.
+class DigestTable:
+    EMPTY = bytes(16)
+
+    def __init__(self, verify = False):
+        self.verify = verify
+        self.n = 0
+        self.collisions = 0
+        self.allocate(1024)
+
+    def allocate(self, m):
+        self.m = m
+        self.slots = bytearray(16 * m)
+        if self.verify:
+            self.offsets = array.array('q', bytes(8 * m))
+
+    def add(self, digest, offset, same = None):
+        if digest == self.EMPTY:
+            digest = bytes(15) + b'\x01'
+        mask = self.m - 1
+        h = int.from_bytes(digest[:8], 'little') & mask
+        slot = self.slots[16 * h:16 * h + 16]
+        collided = False
+        while slot != self.EMPTY:
+            if slot == digest:
+                if same is None or same(self.offsets[h]):
+                    return False
+                collided = True
+            h = (h + 1) & mask
+            slot = self.slots[16 * h:16 * h + 16]
+        if collided:
+            self.collisions = self.collisions + 1
+        self.slots[16 * h:16 * h + 16] = digest
+        if self.verify:
+            self.offsets[h] = offset
+        self.n = self.n + 1
+        if 2 * self.n > self.m:
+            self.grow()
+        return True
+
+    def grow(self):
+        slots = self.slots
+        offsets = self.offsets if self.verify else None
+        self.allocate(2 * self.m)
+        mask = self.m - 1
+        for i in range(0, len(slots), 16):
+            digest = slots[i:i + 16]
+            if digest == self.EMPTY:
+                continue
+            h = int.from_bytes(digest[:8], 'little') & mask
+            while self.slots[16 * h:16 * h + 16] != self.EMPTY:
+                h = (h + 1) & mask
+            self.slots[16 * h:16 * h + 16] = digest
+            if self.verify:
+                self.offsets[h] = offsets[i // 16]
+
+# Deduplicate the text in partitions on disk
+#
+# Rows are written with their row numbers to partitions by crc32 of their
+# texts, so that equal texts are in the same partition. Each partition is
+# deduplicated by itself in a worker process, and the rows kept are merged
+# back in the order of row numbers. Memory is bounded by the texts of one
+# partition per worker, and disk by about twice the input. The temporary
+# files are put next to the output.
+def removePartitioned():
+    directory = tempfile.mkdtemp(
+        prefix = 'remove_duplication_',
+        dir = os.path.dirname(os.path.abspath(OUTPUT)))
+    try:
+        n = partitionRows(directory)
+        jobs = [(directory, k, DIGEST) for k in range(PARTITIONS)]
+        pool = None
+        if WORKERS <= 1:
+            results = map(removePartition, jobs)
+        else:
+            pool = multiprocessing.Pool(WORKERS)
+            results = pool.imap_unordered(removePartition, jobs)
+        valid = 0
+        try:
+            for k, m, kept in results:
+                valid = valid + kept
+                print('Partition {}: lines {}, valid {}'.format(k, m, kept))
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+        mergePartitions(directory)
+        print('Processed lines: {}, valid: {}'.format(n, valid))
+    finally:
+        shutil.rmtree(directory)
+
+# Write rows with their row numbers to partitions by hash of text
+def partitionRows(directory):
+    ifd = open(INPUT, newline = '', encoding = 'utf-8')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    files = [open(partitionFile(directory, k), 'w', newline = '',
+                  encoding = 'utf-8') for k in range(PARTITIONS)]
+    writers = [csv.writer(fd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+               for fd in files]
+    n = 0
+    for row in reader:
+        line = ' '.join(row[1:])
+        k = zlib.crc32(line.encode('utf-8')) % PARTITIONS
+        writers[k].writerow([n] + row)
+        n = n + 1
+        if n % 10000 == 0:
+            print('\rPartitioning line: {}'.format(n), end = '')
+    print('\rPartitioned lines: {}'.format(n))
+    ifd.close()
+    for fd in files:
+        fd.close()
+    return n
+
+# Deduplicate the text of a partition into its file of rows kept
+def removePartition(job):
+    directory, k, algorithm = job
+    filename = partitionFile(directory, k)
+    ifd = open(filename, newline = '', encoding = 'utf-8')
+    ofd = open(filename + '.kept', 'w', newline = '', encoding = 'utf-8')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    if algorithm:
+        digest = createDigest(algorithm)
+        table = DigestTable()
+        add = lambda line: table.add(digest(line.encode('utf-8')), 0)
+    else:
+        s = set()
+        def add(line):
+            if line in s:
+                return False
+            s.add(line)
+            return True
+    n = 0
+    valid = 0
+    for row in reader:
+        n = n + 1
+        # The first field is the row number
+        if add(' '.join(row[2:])):
+            valid = valid + 1
+            writer.writerow(row)
+    ifd.close()
+    ofd.close()
+    os.remove(filename)
+    return k, n, valid
+
+# Merge the rows kept in partitions in the order of row numbers
+def mergePartitions(directory):
+    files = [open(partitionFile(directory, k) + '.kept', newline = '',
+                  encoding = 'utf-8') for k in range(PARTITIONS)]
+    readers = [csv.reader(fd, quoting = csv.QUOTE_ALL) for fd in files]
+    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    n = 0
+    for row in heapq.merge(*readers, key = lambda row: int(row[0])):
+        writer.writerow(row[1:])
+        n = n + 1
+        if n % 10000 == 0:
+            print('\rMerging line: {}'.format(n), end = '')
+    print('\rMerged lines: {}'.format(n))
+    ofd.close()
+    for fd in files:
+        fd.close()
+
+# Name of the file of a partition in the temporary directory
+def partitionFile(directory, k):
+    return os.path.join(directory, 'partition_{:05d}.csv'.format(k))
+
+# Remove near duplicates by MinHash signatures in an LSH banding index
+#
+# The first pass computes MinHash signatures of the character shingles of
+# texts, and keys of their bands, to temporary files. Rows with an equal
+# key in a band are in the same group of the band. Going through the rows
+# in order, a row is compared to the rows kept so far in its groups by the
+# fraction of equal signature values, which estimates their Jaccard
+# similarity. The row is removed if it is similar to one of them at the
+# threshold, and kept otherwise, so that every row removed is similar to a
+# row kept and no row is removed through a chain of removed rows. The
+# threshold applies to the estimate, whose error shrinks with the number of
+# permutations. Equal texts have equal signatures, so exact duplicates are
+# removed too.
+def removeNear():
+    import numpy
+    bands, rows = chooseBands(NEAR, PERMUTATIONS)
+    print('Using {} bands of {} rows for threshold {}'.format(
+        bands, rows, NEAR))
+    sfd = tempfile.TemporaryFile()
+    bfds = [tempfile.TemporaryFile() for band in range(bands)]
+    n = signTexts(sfd, bfds, rows)
+    if n == 0:
+        sfd.close()
+        for fd in bfds:
+            fd.close()
+        writeNear([], [])
+        return
+    sfd.flush()
+    signatures = numpy.memmap(
+        sfd, dtype = numpy.uint32, mode = 'r', shape = (n, PERMUTATIONS))
+    # Replace the keys of each band by their groups on disk
+    groups = list()
+    for band in range(bands):
+        bfds[band].seek(0)
+        keys = numpy.fromfile(bfds[band], dtype = numpy.uint64)
+        group = groupKeys(keys)
+        del keys
+        bfds[band].seek(0)
+        bfds[band].truncate()
+        group.tofile(bfds[band])
+        bfds[band].flush()
+        print('Rows in groups of band {}: {}'.format(
+            band + 1, numpy.count_nonzero(group >= 0)))
+        del group
+        groups.append(numpy.memmap(
+            bfds[band], dtype = numpy.int64, mode = 'r', shape = (n,)))
+    keep, label = selectRows(signatures, groups)
+    del signatures
+    del groups
+    sfd.close()
+    for fd in bfds:
+        fd.close()
+    removed = numpy.bincount(label[~keep], minlength = n)
+    writeNear(keep, removed)
+
+# Choose the bands and rows per band of the LSH index for a threshold
+#
+# The similarity (1 / bands) ^ (1 / rows) at which a pair becomes a
+# candidate with probability about 1/2 is chosen as the largest one not
+# above the threshold, so that few pairs above the threshold are missed.
+def chooseBands(threshold, permutations):
+    choice = (permutations, 1)
+    for rows in range(1, permutations + 1):
+        bands = permutations // rows
+        if permutations % rows == 0 and \
+           (1.0 / bands) ** (1.0 / rows) <= threshold:
+            choice = (bands, rows)
+    return choice
+
+# Compute the MinHash signatures and band keys of all rows to files
+def signTexts(sfd, bfds, rows):
+    import numpy
+    # Seeded permutations so that the results are reproducible
+    generator = numpy.random.default_rng(0)
+    multipliers = generator.integers(
+        1, 2 ** 63, PERMUTATIONS, dtype = numpy.uint64) * 2 + 1
+    increments = generator.integers(
+        0, 2 ** 63, PERMUTATIONS, dtype = numpy.uint64)
+    ifd = open(INPUT, newline = '', encoding = 'utf-8')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    n = 0
+    texts = list()
+    for row in reader:
+        texts.append(' '.join(row[1:]))
+        n = n + 1
+        if len(texts) == BATCH:
+            writeSignatures(sfd, bfds, signBatch(
+                texts, multipliers, increments), rows)
+            texts = list()
+            print('\rProcessing line: {}'.format(n), end = '')
+    if len(texts) > 0:
+        writeSignatures(sfd, bfds, signBatch(
+            texts, multipliers, increments), rows)
+    print('\rProcessed lines: {}'.format(n))
+    ifd.close()
+    return n
+
+# Compute the MinHash signatures of a batch of texts
+def signBatch(texts, multipliers, increments):
+    import numpy
+    # Texts shorter than a shingle are padded to one shingle
+    data = b''.join(text.encode('utf-32-le') + bytes(
+        4 * max(SHINGLE - len(text), 0)) for text in texts)
+    points = numpy.frombuffer(data, dtype = numpy.uint32).astype(numpy.uint64)
+    lengths = numpy.array(
+        [max(len(text), SHINGLE) for text in texts], dtype = numpy.int64)
+    # Polynomial hashes of shingles at all positions, wrapping around 2^64
+    size = len(points) - SHINGLE + 1
+    hashes = numpy.zeros(size, dtype = numpy.uint64)
+    for j in range(SHINGLE):
+        hashes = hashes * numpy.uint64(1000003) + points[j:j + size]
+    # Keep the shingles within each text
+    counts = lengths - SHINGLE + 1
+    starts = numpy.cumsum(lengths) - lengths
+    offsets = numpy.cumsum(counts) - counts
+    hashes = hashes[numpy.repeat(starts - offsets, counts) +
+                    numpy.arange(counts.sum())]
+    hashes = mixHashes(hashes)
+    # Minimum of each multiply-shift permutation over the shingles of texts
+    signatures = numpy.empty((len(texts), PERMUTATIONS), dtype = numpy.uint32)
+    for i in range(PERMUTATIONS):
+        permuted = (hashes * multipliers[i] + increments[i]) >> \
+            numpy.uint64(32)
+        signatures[:, i] = numpy.minimum.reduceat(permuted, offsets)
+    return signatures
+
+# Mix bits of 64-bit hashes with the finalizer of splitmix64
+def mixHashes(hashes):
+    import numpy
+    hashes = hashes ^ (hashes >> numpy.uint64(30))
+    hashes = hashes * numpy.uint64(0xbf58476d1ce4e5b9)
+    hashes = hashes ^ (hashes >> numpy.uint64(27))
+    hashes = hashes * numpy.uint64(0x94d049bb133111eb)
+    return hashes ^ (hashes >> numpy.uint64(31))
+
+# Append signatures and keys of their bands to files
+def writeSignatures(sfd, bfds, signatures, rows):
+    import numpy
+    sfd.write(signatures.tobytes())
+    for band in range(len(bfds)):
+        keys = numpy.zeros(len(signatures), dtype = numpy.uint64)
+        for i in range(band * rows, (band + 1) * rows):
+            keys = mixHashes(keys ^ signatures[:, i].astype(numpy.uint64))
+        bfds[band].write(keys.tobytes())
+
+# Number the groups of rows with an equal key, with -1 for a row alone
+def groupKeys(keys):
+    import numpy
+    order = numpy.argsort(keys, kind = 'stable')
+    keys = keys[order]
+    start = numpy.ones(len(keys), dtype = bool)
+    start[1:] = keys[1:] != keys[:-1]
+    number = numpy.cumsum(start) - 1
+    sizes = numpy.bincount(number)
+    group = numpy.empty(len(keys), dtype = numpy.int64)
+    group[order] = numpy.where(sizes[number] > 1, number, -1)
+    return group
+
+# Select the rows to keep in order, labeling each removed row by a kept row
+#
+# Rows alone in all bands are kept without comparisons. The groups are read
+# from disk in batches, and only rows kept are remembered in the groups.
+def selectRows(signatures, groups):
+    import numpy
+    n = len(signatures)
+    keep = numpy.ones(n, dtype = bool)
+    label = numpy.arange(n)
+    kept = [dict() for group in groups]
+    valid = 0
+    for start in range(0, n, BATCH * 10):
+        batch = numpy.stack(
+            [group[start:start + BATCH * 10] for group in groups], axis = 1)
+        for j in numpy.flatnonzero((batch >= 0).any(axis = 1)).tolist():
+            i = start + j
+            numbers = batch[j].tolist()
+            candidates = set()
+            for band, number in enumerate(numbers):
+                if number >= 0:
+                    candidates.update(kept[band].get(number, ()))
+            if len(candidates) > 0:
+                candidates = numpy.array(sorted(candidates))
+                similarity = (signatures[candidates] == signatures[i]).mean(
+                    axis = 1)
+                best = numpy.argmax(similarity)
+                if similarity[best] >= NEAR:
+                    keep[i] = False
+                    label[i] = candidates[best]
+                    continue
+            for band, number in enumerate(numbers):
+                if number >= 0:
+                    kept[band].setdefault(number, list()).append(i)
+        valid = valid + numpy.count_nonzero(keep[start:start + BATCH * 10])
+        print('\rSelecting line: {}, valid: {}'.format(
+            min(start + BATCH * 10, n), valid), end = '')
+    print('\rSelected lines: {}, valid: {}'.format(n, valid))
+    return keep, label
+
+# Write the rows kept and the number of rows removed in their clusters
+def writeNear(keep, removed):
+    ifd = open(INPUT, newline = '', encoding = 'utf-8')
+    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
+    cfd = open(os.path.splitext(OUTPUT)[0] + '_clusters.csv', 'w',
+               newline = '', encoding = 'utf-8')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    cluster_writer = csv.writer(
+        cfd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    n = 0
+    valid = 0
+    clusters = 0
+    for row in reader:
+        if keep[n]:
+            valid = valid + 1
+            writer.writerow(row)
+            if removed[n] > 0:
+                clusters = clusters + 1
+                cluster_writer.writerow(
+                    [n + 1, removed[n], ' '.join(row[1:])])
+        n = n + 1
+        if n % 10000 == 0:
+            print('\rProcessing line: {}, valid: {}'.format(n, valid), end = '')
+    print('\rProcessed lines: {}, valid: {}'.format(n, valid))
+    print('Clusters with removed rows: {}'.format(clusters))
+    ifd.close()
+    ofd.close()
+    cfd.close()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,252 @@
+'''
+Parallel conversion of csv files by chunks of lines
+Copyright 2016 Xiang Zhang
+
+Usage: import runner; runner.run(input, output, create, workers, resume)
+    runner.mapChunks(function, chunks, workers, initializer, initargs)
+'''
+
+# Number of rows in a batch for a single process
+CHUNK = 1000
+# Number of bytes in a chunk of lines for worker processes
+CHUNK_SIZE = 4194304
+# Number of seconds between checkpoints
+CHECKPOINT = 300
+# Row conversion function used by the worker processes
+CONVERT = None
+# Error of initializing a worker process of mapChunks()
+ERROR = None
+
+import collections
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+
+# Convert the rows of input to output with the function returned by create()
+#
+# Newlines in fields are escaped as '\\n' in the datasets, so that each line
+# is a row. With more than 1 worker, the input is split at line boundaries
+# into chunks of about CHUNK_SIZE bytes converted by the worker processes,
+# and the outputs of chunks are written in order. The function create() is
+# called once in each process, and its errors are raised by run().
+#
+# Every CHECKPOINT seconds the input offset, output offset and number of
+# rows converted are written to the checkpoint file of output. With resume,
+# the output is truncated to the offset in the checkpoint and the conversion
+# continues from there. The checkpoint is removed when the run completes.
+def run(input, output, create, workers = 1, resume = False):
+    checkpoint = readCheckpoint(output, input) if resume else None
+    if checkpoint is not None:
+        start, n = checkpoint['input'], checkpoint['rows']
+        print('Resuming from line: {}'.format(n))
+        os.truncate(output, checkpoint['files'][0][1])
+        ofd = open(output, 'a', encoding = 'utf-8', newline = '')
+    else:
+        start, n = 0, 0
+        ofd = open(output, 'w', encoding = 'utf-8', newline = '')
+    if workers <= 1:
+        n = runSerial(input, ofd, create, start, n)
+    else:
+        n = runParallel(input, ofd, create, workers, start, n)
+    print('\rProcessed lines: {}'.format(n))
+    ofd.close()
+    removeCheckpoint(output)
+
+# Convert the rows in a single process
+def runSerial(input, ofd, create, start = 0, n = 0):
+    initWorker(create)
+    lines = LineReader(input, start)
+    reader = csv.reader(lines, quoting = csv.QUOTE_ALL)
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    # Loop over the batches of csv rows
+    saved = time.time()
+    rows = list()
+    for row in reader:
+        rows.append(CONVERT(row))
+        n = n + 1
+        if len(rows) == CHUNK:
+            writer.writerows(rows)
+            rows = list()
+            print('\rProcessing line: {}'.format(n), end = '')
+            if time.time() - saved >= CHECKPOINT:
+                writeCheckpoint(ofd.name, input, lines.offset, n, [ofd])
+                saved = time.time()
+    writer.writerows(rows)
+    lines.close()
+    return n
+
+# Convert the chunks of lines in worker processes
+def runParallel(input, ofd, create, workers, start = 0, n = 0):
+    saved = time.time()
+    for end, (text, m) in mapChunks(
+            convertChunk, splitChunks(input, start), workers, initWorker,
+            (create,)):
+        ofd.write(text)
+        n = n + m
+        print('\rProcessing line: {}'.format(n), end = '')
+        if time.time() - saved >= CHECKPOINT:
+            writeCheckpoint(ofd.name, input, end, n, [ofd])
+            saved = time.time()
+    return n
+
+# Map a function over chunks in worker processes, in order
+#
+# The chunks are pairs of (key, argument), and function(argument) is called
+# in a pool of worker processes, each initialized by initializer(*initargs)
+# if given. The results are given as (key, result) in the order of chunks,
+# with at most 2 chunks per worker in flight. Errors of the initializer or
+# the function are raised here, and the pool is then terminated.
+def mapChunks(function, chunks, workers, initializer = None, initargs = ()):
+    pool = multiprocessing.Pool(
+        workers, initializer = initPool, initargs = (initializer, initargs))
+    # Bound the number of chunks in flight
+    pending = collections.deque()
+    try:
+        for key, argument in chunks:
+            pending.append((key, pool.apply_async(
+                callChunk, (function, argument))))
+            if len(pending) >= 2 * workers:
+                key, result = pending.popleft()
+                yield key, result.get()
+        while len(pending) > 0:
+            key, result = pending.popleft()
+            yield key, result.get()
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+# Initialize a process of the pool, keeping the error for its chunks
+#
+# An error raised by a pool initializer would make the pool start new
+# processes forever, so it is raised when calling chunks instead.
+def initPool(initializer, initargs):
+    global ERROR
+    if initializer is None:
+        return
+    try:
+        initializer(*initargs)
+    except Exception as error:
+        ERROR = error
+
+# Call the function on a chunk in a process of the pool
+def callChunk(function, argument):
+    if ERROR is not None:
+        raise ERROR
+    return function(argument)
+
+# Split the input to chunks of whole lines by byte offsets
+#
+# Each chunk is given with its end offset for mapChunks().
+def splitChunks(input, start = 0):
+    size = os.path.getsize(input)
+    ifd = open(input, 'rb')
+    while start < size:
+        ifd.seek(min(start + CHUNK_SIZE, size))
+        ifd.readline()
+        end = ifd.tell()
+        yield end, (input, start, end)
+        start = end
+    ifd.close()
+
+# Initialize the row conversion function in a process
+def initWorker(create):
+    global CONVERT
+    CONVERT = create()
+
+# Convert a chunk of lines in the input
+def convertChunk(chunk):
+    input, start, end = chunk
+    ifd = open(input, 'rb')
+    ifd.seek(start)
+    text = ifd.read(end - start).decode('utf-8')
+    ifd.close()
+    reader = csv.reader(io.StringIO(text, newline = ''),
+                        quoting = csv.QUOTE_ALL)
+    ofd = io.StringIO(newline = '')
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    n = 0
+    for row in reader:
+        writer.writerow(CONVERT(row))
+        n = n + 1
+    return ofd.getvalue(), n
+
+# Lines of a csv file for the csv reader, keeping the byte offset read
+class LineReader:
+    def __init__(self, input, offset = 0):
+        self.fd = open(input, 'rb')
+        self.fd.seek(offset)
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.fd.readline()
+        if not line:
+            raise StopIteration
+        self.offset = self.offset + len(line)
+        return line.decode('utf-8')
+
+    def close(self):
+        self.fd.close()
+
+# Checkpoint file of an output file
+def checkpointFile(output):
+    return output + '.checkpoint'
+
+# Write a checkpoint of output after the rows before an input offset
+#
+# The files written are synced to disk first, so that the checkpoint never
+# points past what has been written, and their names and offsets are
+# recorded. The input size and modification time, and the options that
+# decide the files written, are recorded to avoid resuming on a different
+# input or with different options. Other state must be plain json data.
+def writeCheckpoint(output, input, offset, n, files, options = None,
+                    **state):
+    for fd in files:
+        fd.flush()
+        os.fsync(fd.fileno())
+    stat = os.stat(input)
+    checkpoint = dict(state, input = offset, rows = n,
+                      files = [[fd.name, fd.tell()] for fd in files],
+                      size = stat.st_size, mtime = stat.st_mtime_ns,
+                      options = options)
+    filename = checkpointFile(output)
+    fd = open(filename + '.tmp', 'w')
+    json.dump(checkpoint, fd)
+    fd.close()
+    os.replace(filename + '.tmp', filename)
+
+# Read the checkpoint of output as a dict, if it is valid for the input
+def readCheckpoint(output, input, options = None):
+    filename = checkpointFile(output)
+    if not os.path.exists(filename):
+        return None
+    fd = open(filename)
+    checkpoint = json.load(fd)
+    fd.close()
+    stat = os.stat(input)
+    # Options are compared as they were read back from json
+    if checkpoint['size'] != stat.st_size or \
+       checkpoint['mtime'] != stat.st_mtime_ns or \
+       checkpoint['options'] != json.loads(json.dumps(options)) or \
+       any(not os.path.exists(name) or position > os.path.getsize(name)
+           for name, position in checkpoint['files']):
+        print('Checkpoint does not match input, starting over')
+        return None
+    return checkpoint
+
+# State file kept with the checkpoint of output until the run completes
+def stateFile(output):
+    return checkpointFile(output) + '.state'
+
+# Remove the checkpoint of output and its state after a completed run
+def removeCheckpoint(output):
+    for filename in checkpointFile(output), stateFile(output):
+        if os.path.exists(filename):
+            os.remove(filename)
@@ -0,0 +1,1177 @@
+'''
+Word segmentation engine for converting datasets to Index of Words
+Copyright 2016 Xiang Zhang
+
+Usage: import segmenter; segmenter.main(input, output, list, backend)
+'''
+
+# Input file
+INPUT = None
+# Output file
+OUTPUT = None
+# List file
+LIST = None
+# Read already defined word list
+READ = False
+# Spill file for segmented tokens
+SPILL = None
+# Number of worker processes
+WORKERS = 1
+# Segmentation cache file
+CACHE = None
+# Maximum number of fields in segmentation cache
+CACHE_SIZE = 10000000
+# Word segmentation backend
+BACKEND = 'jieba'
+# Dictionary path for the backend
+DICTIONARY = None
+# Output format
+FORMAT = 'csv'
+# Maximum number of words in list
+MAX_VOCAB = None
+# Minimum count of words in list
+MIN_COUNT = None
+# Maximum number of distinct words counted in memory
+BUDGET = None
+# Count state file for incremental word list updates
+STATE = None
+# Views of text fields written in the same pass as list of (name, file)
+VIEWS = ()
+# Resume from the checkpoint of output
+RESUME = False
+# Number of rows in a chunk
+CHUNK = 1000
+# Word index used by the segmenter processes
+WORD_INDEX = None
+# Segmentation cache connection used by the segmenter processes
+CACHE_DB = None
+# Keys of cache hits of the process whose use is not yet refreshed
+CACHE_HITS = None
+# Number of fields stored in cache by the process since it was trimmed
+CACHE_ADDED = 0
+# Number of cache hits whose use is refreshed at a time
+CACHE_REFRESH = 100000
+# Segmenter version used by the segmenter processes
+CACHE_VERSION = None
+# Batch segmentation function used by the segmenter processes
+SEGMENTER = None
+# Backend, dictionary and shared views of SEGMENTER
+SEGMENTER_OPTIONS = None
+# View functions used by the segmenter processes as list of (name, function)
+VIEW_FUNCTIONS = ()
+# View outputs of fields shared by the segmenter in the current chunk
+SHARED = dict()
+
+import argparse
+import array
+import csv
+import functools
+import hashlib
+import heapq
+import importlib
+import importlib.util
+import itertools
+import json
+import mmap
+import multiprocessing.util
+import os
+import pickle
+import runner
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+# Main program with defaults given by the dataset script
+def main(input = INPUT, output = OUTPUT, word_list = LIST, backend = BACKEND,
+         dictionary = DICTIONARY):
+    global INPUT
+    global OUTPUT
+    global LIST
+    global READ
+    global SPILL
+    global WORKERS
+    global CACHE
+    global CACHE_SIZE
+    global BACKEND
+    global DICTIONARY
+    global FORMAT
+    global MAX_VOCAB
+    global MIN_COUNT
+    global BUDGET
+    global STATE
+    global VIEWS
+    global RESUME
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help = 'Input file', default = input)
+    parser.add_argument(
+        '-o', '--output', help = 'Output file', default = output)
+    parser.add_argument(
+        '-l', '--list', help = 'Word list file', default = word_list)
+    parser.add_argument(
+        '-r', '--read', help = 'Read from list file', action = 'store_true')
+    parser.add_argument(
+        '-s', '--spill', help = 'Spill file for segmented tokens')
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes',
+        type = int, default = WORKERS)
+    parser.add_argument(
+        '-c', '--cache', help = 'Segmentation cache file')
+    parser.add_argument(
+        '--cache_size', help = 'Maximum number of fields in cache, trimmed '
+        'at the start and end of a run and as fields are added',
+        type = int, default = CACHE_SIZE)
+    parser.add_argument(
+        '-b', '--backend', help = 'Word segmentation backend',
+        choices = sorted(BACKENDS), default = backend)
+    parser.add_argument(
+        '-d', '--dictionary', help = 'Dictionary path for the backend',
+        default = dictionary)
+    parser.add_argument(
+        '-f', '--format', help = 'Output format', choices = ['csv', 'npy'],
+        default = FORMAT)
+    parser.add_argument(
+        '--max_vocab', help = 'Maximum number of words in list', type = int,
+        default = MAX_VOCAB)
+    parser.add_argument(
+        '--min_count', help = 'Minimum count of words in list', type = int,
+        default = MIN_COUNT)
+    parser.add_argument(
+        '--budget', help = 'Maximum number of distinct words counted in memory '
+        'while counting (the selected word list is still in memory, bounded '
+        'only by --max_vocab)', type = int, default = BUDGET)
+    parser.add_argument(
+        '--state', help = 'Count state file for incremental updates')
+    parser.add_argument(
+        '-v', '--view', help = 'View of text fields ({}) and its output '
+        'file'.format(', '.join(sorted(VIEW_MODULES))), nargs = 2,
+        metavar = ('view', 'file'), action = 'append', default = [])
+    parser.add_argument(
+        '--resume', help = 'Resume from checkpoint of output',
+        action = 'store_true')
+
+    args = parser.parse_args()
+
+    INPUT = args.input
+    OUTPUT = args.output
+    LIST = args.list
+    READ = args.read
+    SPILL = args.spill
+    WORKERS = args.workers
+    CACHE = args.cache
+    CACHE_SIZE = args.cache_size
+    BACKEND = args.backend
+    DICTIONARY = args.dictionary
+    FORMAT = args.format
+    MAX_VOCAB = args.max_vocab
+    MIN_COUNT = args.min_count
+    BUDGET = args.budget
+    STATE = args.state
+    VIEWS = [tuple(view) for view in args.view]
+    RESUME = args.resume
+
+    if BUDGET and SPILL:
+        parser.error('argument --budget: not allowed with argument -s/--spill')
+    if BUDGET and STATE:
+        parser.error('argument --budget: not allowed with argument --state')
+    if RESUME and BUDGET:
+        parser.error('argument --resume: not allowed with argument --budget')
+    if RESUME and FORMAT == 'npy':
+        parser.error('argument --resume: not allowed with argument -f/--format '
+                     'npy')
+    for name, filename in VIEWS:
+        if name not in VIEW_MODULES or \
+           importlib.util.find_spec(VIEW_MODULES[name]) is None:
+            parser.error('argument -v/--view: view {} not available'.format(
+                name))
+
+    # Interrupted runs may have left the cache over its size
+    if CACHE:
+        print('Trimming segmentation cache')
+        trimCacheFile()
+    checkpoint = readCheckpoint() if RESUME else None
+    if checkpoint is not None:
+        print('Resuming {} from line: {}'.format(
+            checkpoint['phase'], checkpoint['rows']))
+    if READ or (checkpoint is not None and checkpoint['phase'] == 'convert'):
+        print('Reading word index')
+        word_index = readWords()
+    else:
+        counter = WordCounter()
+        n = 0
+        inputs = list()
+        previous = None
+        if STATE and os.path.exists(STATE):
+            print('Reading count state')
+            counter, n, inputs = readState()
+            if inputInfo() in inputs:
+                parser.error('argument --state: input {} already counted in '
+                             'state {}'.format(INPUT, STATE))
+            previous = rankWords(counter)
+        print('Counting words')
+        counter, n, spill_words = segmentWords(
+            counter, n, inputs, checkpoint)
+        print('Sorting words by count')
+        word_index = sortWords(counter, n)
+        if previous is not None:
+            print('Reporting changed word indices')
+            reportChanges(previous, word_index)
+        checkpoint = None
+    print('Constructing word index output')
+    if SPILL and not READ:
+        if checkpoint is not None:
+            spill_words = checkpoint['spill_words']
+        convertSpill(spill_words, word_index, checkpoint)
+    else:
+        convertWords(word_index, checkpoint)
+    if STATE and not READ:
+        print('Updating count state')
+        updateState()
+    runner.removeCheckpoint(OUTPUT)
+    if CACHE:
+        print('Trimming segmentation cache')
+        trimCacheFile()
+
+# Read from pre-existing word list
+def readWords():
+    # Use the compiled word index if it is up to date with the list
+    index = VocabularyIndex.open(indexFile(LIST), LIST)
+    if index is not None:
+        print('Mapped words: {}'.format(len(index)))
+        return index
+    # Open the files
+    ifd = open(LIST, encoding = 'utf-8', newline = '')
+    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
+    # Loop over the csv rows
+    word_index = dict()
+    n = 0
+    for row in reader:
+        word = row[0].replace('\\n', '\n')
+        word_index[word] = n + 1
+        n = n + 1
+        if n % 1000 == 0:
+            print('\rProcessing line: {}'.format(n), end = '')
+    print('\rProcessed lines: {}'.format(n))
+    ifd.close()
+    # Compile the word index for later runs, if the directory is writable
+    try:
+        VocabularyIndex.write(indexFile(LIST), LIST, list(word_index))
+    except OSError as e:
+        print('Word index not compiled: {}'.format(e))
+    return word_index
+
+# Segment the text, adding to the counts of previous rows and inputs
+def segmentWords(counter, n, inputs, checkpoint = None):
+    start = 0
+    m = 0
+    positions = None
+    if checkpoint is not None:
+        # Counts of the rows before the checkpoint include the previous rows
+        start = checkpoint['input']
+        m = checkpoint['rows']
+        positions = checkpoint['files']
+        counter = loadCounter(checkpoint['counter'])
+        n = checkpoint['previous']
+    # Open the files
+    lines = runner.LineReader(INPUT, start)
+    sfd = None
+    if SPILL:
+        sfd = openFile(SPILL, 'b', positions and positions.pop(0))
+    view_files = openViews(VIEWS, positions)
+    files = ([sfd] if sfd else []) + [ofd for ofd, writer in view_files]
+    # Loop over the csv chunks
+    runs = list()
+    order = 0
+    saved = time.time()
+    for offset, (chunk_counter, chunk_rows, view_rows) in mapChunks(
+            functools.partial(countChunk, sfd is not None), lines,
+            views = VIEWS):
+        # Chunks come in order, so merged ids keep first-count order
+        counter.merge(chunk_counter)
+        writeViews(view_files, view_rows)
+        if sfd:
+            for label, field_lists in chunk_rows:
+                writeSpill(sfd, label, [array.array('I', map(
+                    counter.word_id.__getitem__, field_list))
+                                        for field_list in field_lists])
+        if BUDGET and len(counter) > BUDGET:
+            runs.append(spillCounts(counter, order))
+            order = order + len(counter)
+            counter = WordCounter()
+        m = m + len(chunk_rows)
+        print('\rProcessing line: {}'.format(m), end = '')
+        # Partial counts are not kept in memory with a budget
+        if not BUDGET and time.time() - saved >= runner.CHECKPOINT:
+            writeCheckpoint('count', offset, m, files,
+                            counter = jsonCounter(counter), previous = n)
+            saved = time.time()
+    print('\rProcessed lines: {}'.format(m))
+    lines.close()
+    if sfd:
+        sfd.close()
+    closeViews(view_files)
+    n = n + m
+    if STATE:
+        # The state is updated only after the output is constructed
+        print('Writing count state')
+        writeState(counter, n, inputs + [inputInfo()])
+    # Spilled ids are the counter ids before selection
+    spill_words = None
+    if sfd:
+        spill_words = list(counter.word_id)
+    if len(runs) > 0 or MAX_VOCAB or MIN_COUNT:
+        print('Selecting words from {} spilled runs'.format(len(runs)))
+        counter = selectWords(counter, runs, order)
+    return counter, n, spill_words
+
+# Counter of words interned to dense ids in first-count order
+class WordCounter:
+    def __init__(self):
+        self.word_id = dict()
+        self.count = array.array('q')
+        self.freq = array.array('q')
+
+    def __len__(self):
+        return len(self.word_id)
+
+    def add(self, word, count, freq):
+        i = self.word_id.get(word)
+        if i is None:
+            self.word_id[word] = len(self.count)
+            self.count.append(count)
+            self.freq.append(freq)
+        else:
+            self.count[i] = self.count[i] + count
+            self.freq[i] = self.freq[i] + freq
+
+    def merge(self, other):
+        for word, i in other.word_id.items():
+            self.add(word, other.count[i], other.freq[i])
+
+# Spill word counts to a temporary run file sorted by word
+def spillCounts(counter, order):
+    records = sorted(
+        (word, counter.count[i], counter.freq[i], order + i)
+        for word, i in counter.word_id.items())
+    fd = tempfile.TemporaryFile()
+    for i in range(0, len(records), 10000):
+        pickle.dump(records[i:i + 10000], fd, pickle.HIGHEST_PROTOCOL)
+    fd.seek(0)
+    return fd
+
+# Read word count records from a run file
+def readRun(fd):
+    while True:
+        try:
+            records = pickle.load(fd)
+        except EOFError:
+            fd.close()
+            return
+        for record in records:
+            yield record
+
+# Select words by minimum count and maximum number in sorted order
+#
+# Each record is (word, count, document count, first count order). Ties
+# in count are broken by first count order, which is the same order as
+# the stable sort of a counter counted in one pass.
+def selectWords(counter, runs, order):
+    records = ((word, counter.count[i], counter.freq[i], order + i)
+               for word, i in counter.word_id.items())
+    if len(runs) > 0:
+        # Merge runs sorted by word and sum up the counts of each word
+        runs = [readRun(fd) for fd in runs]
+        runs.append(iter(sorted(records)))
+        records = (functools.reduce(lambda a, b: (
+            a[0], a[1] + b[1], a[2] + b[2], min(a[3], b[3])), group)
+                   for word, group in itertools.groupby(
+                       heapq.merge(*runs), key = lambda record: record[0]))
+    # Keep the largest words in a heap of (count, -first, word, freq)
+    heap = list()
+    for word, count, freq, first in records:
+        if MIN_COUNT and count < MIN_COUNT:
+            continue
+        item = (count, -first, word, freq)
+        if not MAX_VOCAB or len(heap) < MAX_VOCAB:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    counter = WordCounter()
+    for count, first, word, freq in sorted(heap, reverse = True):
+        counter.add(word, count, freq)
+    return counter
+
+# Count words in a chunk of csv rows
+def countChunk(segmented, rows):
+    counter = WordCounter()
+    word_id = counter.word_id
+    count = counter.count
+    freq = counter.freq
+    # Last row in which a word is counted for document frequency
+    last = array.array('i')
+    chunk_rows = list()
+    segmented_fields = iter(segmentFields(
+        [row[i].replace('\\n', '\n') for row in rows
+         for i in range(1, len(row))]))
+    for r in range(len(rows)):
+        row = rows[r]
+        field_lists = list()
+        for i in range(1, len(row)):
+            field_list = next(segmented_fields)
+            for word in field_list:
+                k = word_id.get(word)
+                if k is None:
+                    word_id[word] = len(count)
+                    count.append(1)
+                    freq.append(1)
+                    last.append(r)
+                else:
+                    count[k] = count[k] + 1
+                    if last[k] != r:
+                        last[k] = r
+                        freq[k] = freq[k] + 1
+            if segmented:
+                field_lists.append(field_list)
+        chunk_rows.append((row[0], field_lists))
+    return counter, chunk_rows, viewChunk(rows)
+
+# Sort word ids by count, keeping first-count order for ties
+def sortIds(counter):
+    return sorted(range(len(counter)), key = counter.count.__getitem__,
+                  reverse = True)
+
+# Sort words for a given word counter
+def sortWords(counter, n):
+    word_list = list(counter.word_id)
+    id_list = sortIds(counter)
+    # Open the files
+    ofd = open(LIST, 'w', encoding = 'utf-8', newline = '')
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    # Loop over all the words
+    word_index = dict()
+    n_words = 0
+    for i in range(len(id_list)):
+        word = word_list[id_list[i]]
+        # Normalizing word frequency
+        row = [word.replace('\n', '\\n'), str(counter.count[id_list[i]]),
+               str(float(counter.freq[id_list[i]]) / float(n))]
+        writer.writerow(row)
+        word_index[word] = i + 1
+        n_words = n_words + 1
+        if n_words % 1000 == 0:
+            print('\rProcessing word: {}'.format(n_words), end = '')
+    print('\rProcessed words: {}'.format(n_words))
+    ofd.close()
+    VocabularyIndex.write(
+        indexFile(LIST), LIST, [word_list[i] for i in id_list])
+    return word_index
+
+# Words in word list order for a given word counter before selection
+def rankWords(counter):
+    if MAX_VOCAB or MIN_COUNT:
+        counter = selectWords(counter, list(), 0)
+    word_list = list(counter.word_id)
+    return [word_list[i] for i in sortIds(counter)]
+
+# Report words whose indices changed from a previous word list
+#
+# The report has rows of word, previous index and new index, with index 0
+# for words not in the list.
+def reportChanges(previous, word_index):
+    ofd = open(os.path.splitext(LIST)[0] + '_changes.csv', 'w',
+               encoding = 'utf-8', newline = '')
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    previous_index = dict()
+    n_changed = 0
+    for i in range(len(previous)):
+        word = previous[i]
+        previous_index[word] = i + 1
+        if word_index.get(word, 0) != i + 1:
+            writer.writerow([word.replace('\n', '\\n'), str(i + 1),
+                             str(word_index.get(word, 0))])
+            n_changed = n_changed + 1
+    n_added = 0
+    for word, index in word_index.items():
+        if word not in previous_index:
+            writer.writerow([word.replace('\n', '\\n'), '0', str(index)])
+            n_added = n_added + 1
+    ofd.close()
+    print('Changed words: {}, added words: {}'.format(n_changed, n_added))
+
+# Read word counts, number of rows and inputs from count state file
+def readState():
+    fd = open(STATE, 'rb')
+    n, word_list, count, freq, inputs = pickle.load(fd)
+    fd.close()
+    return loadCounter((word_list, count, freq)), n, inputs
+
+# Write word counts, number of rows and inputs to the state of the checkpoint
+#
+# The count state file is updated from it only after the output is
+# constructed, so that a run interrupted before then, whether resumed or
+# run again, never counts its input twice in the count state file.
+def writeState(counter, n, inputs):
+    filename = runner.stateFile(OUTPUT)
+    fd = open(filename + '.tmp', 'wb')
+    pickle.dump((n,) + dumpCounter(counter) + (inputs,), fd,
+                pickle.HIGHEST_PROTOCOL)
+    fd.close()
+    os.replace(filename + '.tmp', filename)
+
+# Replace the count state file with the state of the checkpoint
+def updateState():
+    shutil.copyfile(runner.stateFile(OUTPUT), STATE + '.tmp')
+    os.replace(STATE + '.tmp', STATE)
+
+# Path, size and modification time of the input recorded in count state
+def inputInfo():
+    stat = os.stat(INPUT)
+    return os.path.abspath(INPUT), stat.st_size, stat.st_mtime_ns
+
+# Word counter as a tuple of words in id order, counts and document counts
+def dumpCounter(counter):
+    return list(counter.word_id), counter.count, counter.freq
+
+# Word counter as json lists of words in id order, counts and document counts
+def jsonCounter(counter):
+    return [list(counter.word_id), counter.count.tolist(),
+            counter.freq.tolist()]
+
+# Word counter from words in id order, counts and document counts
+def loadCounter(data):
+    word_list, count, freq = data
+    counter = WordCounter()
+    counter.word_id = dict(zip(word_list, range(len(word_list))))
+    counter.count = array.array('q', count)
+    counter.freq = array.array('q', freq)
+    return counter
+
+# Write a checkpoint of a phase after the rows before an input offset
+def writeCheckpoint(phase, offset, n, files, **state):
+    runner.writeCheckpoint(OUTPUT, INPUT, offset, n, files,
+                           checkpointOptions(), phase = phase, **state)
+
+# Read the checkpoint of output, if it is valid for the input and options
+def readCheckpoint():
+    checkpoint = runner.readCheckpoint(OUTPUT, INPUT, checkpointOptions())
+    if checkpoint is not None:
+        checkpoint['files'] = [
+            position for name, position in checkpoint['files']]
+    return checkpoint
+
+# Options that decide the files written in the phases of a checkpoint
+def checkpointOptions():
+    return [READ, SPILL, list(VIEWS), STATE, BACKEND, DICTIONARY, MAX_VOCAB,
+            MIN_COUNT, FORMAT]
+
+# Open a file for writing, or truncate it to a checkpoint position to append
+def openFile(filename, mode = '', position = None):
+    options = dict() if mode == 'b' else dict(encoding = 'utf-8', newline = '')
+    if position is None:
+        return open(filename, 'w' + mode, **options)
+    os.truncate(filename, position)
+    return open(filename, 'a' + mode, **options)
+
+# Compiled word index file for a word list file
+def indexFile(word_list):
+    return os.path.splitext(word_list)[0] + '.idx'
+
+# Memory-mapped word index compiled from a word list
+#
+# The file has a 40-byte header of magic 'WORDIDX\0' followed by
+# little-endian uint64 number of words n, uint64 number of hash slots m,
+# and int64 size and modification time of the word list it was compiled
+# from. Then come n + 1 uint64 offsets of words in the string table, m
+# uint32 slots of an open addressing hash table keyed by crc32 of the
+# word with 0 for empty slots, and the string table of utf-8 words in
+# index order. Word i (starting from 1) is table[offset[i - 1]:offset[i]].
+#
+# Words found are remembered in a dict of the process, up to CACHE words,
+# because probing the table in python is about 10 times slower than a dict
+# lookup. The frequent words that make most of the lookups are then as fast
+# as with the dict of the word list, while the dict stays much smaller.
+class VocabularyIndex:
+    MAGIC = b'WORDIDX\0'
+    HEADER = '<8sQQqq'
+    CACHE = 1048576
+
+    def __init__(self, filename, fd):
+        self.filename = filename
+        self.cache = dict()
+        self.fd = fd
+        self.map = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.n, m, size, mtime = struct.unpack_from(
+            self.HEADER, self.map)
+        self.mask = m - 1
+        view = memoryview(self.map)
+        start = struct.calcsize(self.HEADER)
+        self.offset = self.column(view[start:start + 8 * (self.n + 1)], 'Q')
+        start = start + 8 * (self.n + 1)
+        self.slots = self.column(view[start:start + 4 * m], 'I')
+        start = start + 4 * m
+        self.table = view[start:]
+
+    @staticmethod
+    def column(view, typecode):
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        data = array.array(typecode, view.tobytes())
+        data.byteswap()
+        return data
+
+    @classmethod
+    def open(cls, filename, word_list):
+        if not os.path.exists(filename):
+            return None
+        fd = open(filename, 'rb')
+        try:
+            magic, n, m, size, mtime = struct.unpack(
+                cls.HEADER, fd.read(struct.calcsize(cls.HEADER)))
+        except struct.error:
+            fd.close()
+            return None
+        stat = os.stat(word_list)
+        if magic != cls.MAGIC or size != stat.st_size or \
+           mtime != stat.st_mtime_ns:
+            fd.close()
+            return None
+        return cls(filename, fd)
+
+    @classmethod
+    def write(cls, filename, word_list, words):
+        data = [word.encode('utf-8') for word in words]
+        m = 1
+        while m < 2 * len(data):
+            m = m * 2
+        offset = array.array('Q', [0])
+        slots = array.array('I', [0] * m)
+        for i in range(len(data)):
+            offset.append(offset[-1] + len(data[i]))
+            h = zlib.crc32(data[i]) & (m - 1)
+            while slots[h] != 0:
+                h = (h + 1) & (m - 1)
+            slots[h] = i + 1
+        if sys.byteorder != 'little':
+            offset.byteswap()
+            slots.byteswap()
+        stat = os.stat(word_list)
+        # Other runs only see the index when it is complete
+        fd = open(filename + '.tmp', 'wb')
+        fd.write(struct.pack(cls.HEADER, cls.MAGIC, len(data), m,
+                             stat.st_size, stat.st_mtime_ns))
+        fd.write(offset.tobytes())
+        fd.write(slots.tobytes())
+        for word in data:
+            fd.write(word)
+        fd.close()
+        os.replace(filename + '.tmp', filename)
+
+    def __len__(self):
+        return self.n
+
+    def get(self, word, default = None):
+        i = self.cache.get(word)
+        if i is not None:
+            return i
+        data = word.encode('utf-8')
+        h = zlib.crc32(data) & self.mask
+        i = self.slots[h]
+        while i != 0:
+            if self.table[self.offset[i - 1]:self.offset[i]] == data:
+                if len(self.cache) < self.CACHE:
+                    self.cache[word] = i
+                return i
+            h = (h + 1) & self.mask
+            i = self.slots[h]
+        return default
+
+    # Worker processes map the same file instead of copying the index
+    def __getstate__(self):
+        return self.filename
+
+    def __setstate__(self, filename):
+        self.__init__(filename, open(filename, 'rb'))
+
+# Convert the text to word list
+def convertWords(word_index, checkpoint = None):
+    start = 0
+    n = 0
+    positions = None
+    if checkpoint is not None:
+        start = checkpoint['input']
+        n = checkpoint['rows']
+        positions = checkpoint['files']
+    # Open the files
+    lines = runner.LineReader(INPUT, start)
+    ofd, writer = openOutput(positions and positions.pop(0))
+    # Views are written here only if the words were not counted
+    views = VIEWS if READ else ()
+    view_files = openViews(views, positions)
+    files = [ofd] + [vfd for vfd, view_writer in view_files]
+    # Loop over the csv chunks
+    saved = time.time()
+    for offset, (new_rows, view_rows) in mapChunks(functools.partial(
+            convertChunk, FORMAT == 'npy'), lines, word_index, views):
+        writer.writerows(new_rows)
+        writeViews(view_files, view_rows)
+        n = n + len(new_rows)
+        print('\rProcessing line: {}'.format(n), end = '')
+        if FORMAT == 'csv' and time.time() - saved >= runner.CHECKPOINT:
+            writeCheckpoint('convert', offset, n, files)
+            saved = time.time()
+    print('\rProcessed lines: {}'.format(n))
+    lines.close()
+    ofd.close()
+    closeViews(view_files)
+
+# Convert a chunk of csv rows to word list
+def convertChunk(binary, rows):
+    unknown = len(WORD_INDEX) + 1
+    new_rows = list()
+    segmented_fields = iter(segmentFields(
+        [row[i].replace('\\n', '\n') for row in rows
+         for i in range(1, len(row))]))
+    for row in rows:
+        new_row = list()
+        new_row.append(row[0])
+        for i in range(1, len(row)):
+            field_list = next(segmented_fields)
+            ids = map(lambda word: WORD_INDEX.get(word, unknown), field_list)
+            if binary:
+                new_row.append(array.array('i', ids))
+            else:
+                new_row.append(' '.join(map(str, ids)))
+        new_rows.append(new_row)
+    return new_rows, viewChunk(rows)
+
+# Convert a chunk of csv rows to each of the views
+def viewChunk(rows):
+    view_rows = list()
+    for name, function in VIEW_FUNCTIONS:
+        new_rows = list()
+        for row in rows:
+            new_row = list()
+            new_row.append(row[0])
+            for i in range(1, len(row)):
+                if (name, row[i]) in SHARED:
+                    new_row.append(SHARED[(name, row[i])])
+                else:
+                    new_row.append(function(row[i]))
+            new_rows.append(new_row)
+        view_rows.append(new_rows)
+    SHARED.clear()
+    return view_rows
+
+# Open the output files of views, truncated to positions of a checkpoint
+def openViews(views, positions = None):
+    view_files = list()
+    for name, filename in views:
+        ofd = openFile(filename, '', positions and positions.pop(0))
+        view_files.append((ofd, csv.writer(
+            ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')))
+    return view_files
+
+# Write chunks of view rows to the output files of views
+def writeViews(view_files, view_rows):
+    for k in range(len(view_files)):
+        view_files[k][1].writerows(view_rows[k])
+
+# Close the output files of views
+def closeViews(view_files):
+    for ofd, writer in view_files:
+        ofd.close()
+
+# Convert the spilled tokens to word list
+def convertSpill(spill_words, word_index, checkpoint = None):
+    # Spilled ids are in the order words were first counted
+    word_map = [word_index.get(word, len(word_index) + 1)
+                for word in spill_words]
+    if FORMAT == 'npy':
+        word_map = array.array('i', word_map)
+    else:
+        word_map = list(map(str, word_map))
+    start = 0
+    n = 0
+    position = None
+    if checkpoint is not None:
+        start = checkpoint['input']
+        n = checkpoint['rows']
+        position = checkpoint['files'][0]
+    # Open the files
+    sfd = open(SPILL, 'rb')
+    sfd.seek(start)
+    ofd, writer = openOutput(position)
+    # Loop over the spilled rows
+    saved = time.time()
+    for label, field_ids in readSpill(sfd):
+        new_row = list()
+        new_row.append(label)
+        for ids in field_ids:
+            if FORMAT == 'npy':
+                new_row.append(array.array(
+                    'i', map(word_map.__getitem__, ids)))
+            else:
+                new_row.append(' '.join(map(word_map.__getitem__, ids)))
+        writer.writerow(new_row)
+        n = n + 1
+        if n % 1000 == 0:
+            print('\rProcessing line: {}'.format(n), end = '')
+            if FORMAT == 'csv' and \
+               time.time() - saved >= runner.CHECKPOINT:
+                # Spilled words are needed to resume after the count
+                writeCheckpoint('convert', sfd.tell(), n, [ofd],
+                                spill_words = spill_words)
+                saved = time.time()
+    print('\rProcessed lines: {}'.format(n))
+    sfd.close()
+    ofd.close()
+    os.remove(SPILL)
+
+# Open the output file and its writer in the chosen format
+def openOutput(position = None):
+    if FORMAT == 'npy':
+        writer = CsrWriter(OUTPUT)
+        return writer, writer
+    ofd = openFile(OUTPUT, '', position)
+    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    return ofd, writer
+
+# Writer of word index output as memory-mappable numpy arrays
+#
+# For output prefix p, the files are p_label.npy with int64 labels and,
+# for each text field k starting from 1, p_field{k}_offset.npy with
+# int64 row offsets and p_field{k}_index.npy with int32 word indices.
+# The indices of field k in row i are index[offset[i]:offset[i + 1]].
+class CsrWriter:
+    def __init__(self, output):
+        self.prefix = os.path.splitext(output)[0]
+        self.label = NpyWriter(self.prefix + '_label.npy', 'q')
+        self.offset = list()
+        self.index = list()
+        self.length = list()
+        self.n = 0
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        self.label.write(array.array('q', [int(row[0]) for row in rows]))
+        for k in range(len(self.index), max(map(len, rows)) - 1):
+            self.addField()
+        for k in range(len(self.index)):
+            offset = array.array('q')
+            for row in rows:
+                if k + 1 < len(row):
+                    self.index[k].write(row[k + 1])
+                    self.length[k] = self.length[k] + len(row[k + 1])
+                offset.append(self.length[k])
+            self.offset[k].write(offset)
+        self.n = self.n + len(rows)
+
+    def addField(self):
+        k = len(self.index) + 1
+        offset = NpyWriter(self.prefix + '_field{}_offset.npy'.format(k), 'q')
+        # Rows before a field first appears have it empty
+        offset.write(array.array('q', [0] * (self.n + 1)))
+        self.offset.append(offset)
+        self.index.append(
+            NpyWriter(self.prefix + '_field{}_index.npy'.format(k), 'i'))
+        self.length.append(0)
+
+    def close(self):
+        self.label.close()
+        for k in range(len(self.index)):
+            self.offset[k].close()
+            self.index[k].close()
+
+# Writer of a one-dimensional little-endian numpy array file
+class NpyWriter:
+    # Fixed header size so that the final shape can be rewritten in place
+    HEADER = 128
+
+    def __init__(self, filename, typecode):
+        self.fd = open(filename, 'wb')
+        self.typecode = typecode
+        self.length = 0
+        self.writeHeader()
+
+    def writeHeader(self):
+        array_type = array.array(self.typecode)
+        header = "{{'descr': '<i{}', 'fortran_order': False, 'shape': ({},), }}"
+        header = header.format(array_type.itemsize, self.length)
+        header = header.ljust(self.HEADER - 11) + '\n'
+        self.fd.write(b'\x93NUMPY\x01\x00')
+        self.fd.write(struct.pack('<H', len(header)))
+        self.fd.write(header.encode('latin1'))
+
+    def write(self, data):
+        if sys.byteorder == 'big':
+            data = array.array(self.typecode, data)
+            data.byteswap()
+        self.fd.write(data.tobytes())
+        self.length = self.length + len(data)
+
+    def close(self):
+        self.fd.seek(0)
+        self.writeHeader()
+        self.fd.close()
+
+# Map a function over chunks of csv rows in order
+#
+# The results are given with the input offset after the chunk. Errors of
+# initializing the segmenter in worker processes are raised here.
+def mapChunks(function, lines, word_index = None, views = ()):
+    initargs = (word_index, CACHE, CACHE_SIZE, BACKEND, DICTIONARY, views)
+    if WORKERS <= 1:
+        initSegmenter(*initargs)
+        for offset, rows in readChunks(lines):
+            yield offset, function(rows)
+        return
+    for offset, result in runner.mapChunks(
+            function, readChunks(lines), WORKERS, initSegmenter, initargs):
+        yield offset, result
+
+# Read chunks of csv rows with the input offset after each chunk
+def readChunks(lines):
+    reader = csv.reader(lines, quoting = csv.QUOTE_ALL)
+    rows = list()
+    for row in reader:
+        rows.append(row)
+        if len(rows) == CHUNK:
+            yield lines.offset, rows
+            rows = list()
+    if len(rows) > 0:
+        yield lines.offset, rows
+
+# Initialize the word segmenter in a process
+def initSegmenter(word_index, cache, cache_size, backend, dictionary,
+                  views):
+    global WORD_INDEX
+    global SEGMENTER
+    global SEGMENTER_OPTIONS
+    global CACHE_VERSION
+    global VIEW_FUNCTIONS
+    WORD_INDEX = word_index
+    VIEW_FUNCTIONS = [(name, importlib.import_module(
+        VIEW_MODULES[name]).createView()) for name, filename in views]
+    # Share the MeCab analysis of fields with the Hepburn view if written
+    shared = backend == 'mecab' and not dictionary and \
+        'hepburn' in [name for name, filename in views]
+    # The segmenter is kept across passes in a process unless it changes
+    options = (backend, dictionary, shared)
+    if SEGMENTER is None or SEGMENTER_OPTIONS != options:
+        if shared:
+            SEGMENTER, CACHE_VERSION = createMeCab(
+                dictionary, importlib.import_module(VIEW_MODULES['hepburn']))
+        else:
+            SEGMENTER, CACHE_VERSION = BACKENDS[backend](dictionary)
+        SEGMENTER_OPTIONS = options
+    openCache(cache, cache_size)
+
+# Create the jieba segmenter for Chinese
+def createJieba(dictionary):
+    import jieba
+    if dictionary:
+        jieba.set_dictionary(dictionary)
+    jieba.initialize()
+    version = 'jieba {} {}'.format(jieba.__version__, fileVersion(
+        jieba.dt.dictionary or os.path.join(
+            os.path.dirname(jieba.__file__), 'dict.txt')))
+    def segment(fields):
+        cut = jieba.cut
+        return [list(cut(field)) for field in fields]
+    return segment, version
+
+# Create the MeCab segmenter for Japanese, optionally sharing its analysis
+def createMeCab(dictionary, hepburn = None):
+    import MeCab
+    # Wakati output gives space-separated surfaces in one string
+    if dictionary:
+        mecab = MeCab.Tagger('-Owakati -d {}'.format(dictionary))
+    else:
+        mecab = MeCab.Tagger('-Owakati')
+    info = mecab.dictionary_info()
+    version = 'mecab {} {} {}'.format(
+        MeCab.VERSION, info.version, fileVersion(info.filename))
+    def segment(fields):
+        parse = mecab.parse
+        return [parse(field).split(' ')[:-1] for field in fields]
+    if hepburn is None:
+        return segment, version
+    # Surfaces of the default output are the same as the wakati output
+    tagger = MeCab.Tagger()
+    def segmentShared(fields):
+        parse = mecab.parse
+        result = list()
+        for field in fields:
+            # Newlines are escaped in the text given to the view
+            if '\n' in field:
+                result.append(parse(field).split(' ')[:-1])
+                continue
+            words, tokens = hepburn.analyzeText(tagger, field)
+            SHARED[('hepburn', field)] = hepburn.convertTokens(tokens)
+            result.append(words)
+        return result
+    return segmentShared, version
+
+# Create the KoNLPy MeCab segmenter for Korean
+def createKoNLPy(dictionary):
+    from konlpy.tag import Mecab
+    if dictionary:
+        mecab = Mecab(dictionary)
+    else:
+        mecab = Mecab()
+    version = 'konlpy mecab {}'.format(fileVersion(
+        os.path.join(dictionary or '', 'sys.dic')))
+    def segment(fields):
+        morphs = mecab.morphs
+        return [morphs(field) for field in fields]
+    return segment, version
+
+# Word segmentation backends
+BACKENDS = {'jieba': createJieba, 'mecab': createMeCab, 'konlpy': createKoNLPy}
+# Modules of views by name, each having a createView() function that returns
+# a function converting a text field to the view
+VIEW_MODULES = {'pinyin': 'construct_pinyin', 'hepburn': 'construct_hepburn',
+                'rr': 'construct_rr'}
+
+# Segment fields of text, consulting the segmentation cache first
+def segmentFields(fields):
+    global CACHE_ADDED
+    if CACHE_DB is None:
+        return SEGMENTER(fields)
+    keys = [hashlib.blake2b(
+        (CACHE_VERSION + '\0' + field).encode('utf-8'),
+        digest_size = 16).digest() for field in fields]
+    # Look up the cache in batches under the sqlite variable limit
+    cached = dict()
+    for i in range(0, len(keys), 500):
+        batch = keys[i:i + 500]
+        cached.update(CACHE_DB.execute(
+            'SELECT key, words FROM segment WHERE key IN ({})'.format(
+                ','.join('?' * len(batch))), batch))
+    # Segment the fields not in cache
+    missed = dict()
+    for key, field in zip(keys, fields):
+        if key not in cached:
+            missed[key] = field
+    missed = dict(zip(missed, SEGMENTER(list(missed.values()))))
+    field_lists = list()
+    for key in keys:
+        if key in cached:
+            field_lists.append(json.loads(cached[key]))
+        else:
+            field_lists.append(missed[key])
+    # Store the misses, and refresh the hits and trim the cache in batches
+    used = time.time()
+    with CACHE_DB:
+        CACHE_DB.executemany(
+            'INSERT OR REPLACE INTO segment VALUES (?, ?, ?)',
+            [(key, json.dumps(field_list, ensure_ascii = False), used)
+             for key, field_list in missed.items()])
+    CACHE_HITS.update(cached)
+    if len(CACHE_HITS) >= CACHE_REFRESH:
+        refreshCache()
+    CACHE_ADDED = CACHE_ADDED + len(missed)
+    if CACHE_ADDED > CACHE_SIZE // 10:
+        refreshCache()
+        trimCache(CACHE_DB)
+        CACHE_ADDED = 0
+    return field_lists
+
+# Open the segmentation cache in a process
+#
+# Uses of cache hits are refreshed in batches of CACHE_REFRESH keys, and
+# the rest when the process exits. The cache is trimmed whenever the
+# process has added a tenth of its size, so that it never grows by more
+# than that for each process during a run.
+def openCache(cache, cache_size):
+    global CACHE_DB
+    global CACHE_HITS
+    global CACHE_SIZE
+    if CACHE_DB is not None:
+        refreshCache()
+        CACHE_DB.close()
+    CACHE_DB = None
+    CACHE_SIZE = cache_size
+    if cache:
+        CACHE_DB = connectCache(cache)
+        if CACHE_HITS is None:
+            CACHE_HITS = set()
+            multiprocessing.util.Finalize(
+                None, refreshCache, exitpriority = 10)
+
+# Connect to the segmentation cache, creating its table if needed
+def connectCache(cache):
+    db = sqlite3.connect(cache, timeout = 3600)
+    db.execute('PRAGMA journal_mode = WAL')
+    with db:
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS segment '
+            '(key BLOB PRIMARY KEY, words TEXT, used REAL)')
+        db.execute(
+            'CREATE INDEX IF NOT EXISTS segment_used ON segment (used)')
+    return db
+
+# Refresh the use time of the cache hits of the process
+def refreshCache():
+    if CACHE_DB is None or not CACHE_HITS:
+        return
+    hits = list(CACHE_HITS)
+    CACHE_HITS.clear()
+    used = time.time()
+    with CACHE_DB:
+        for i in range(0, len(hits), 500):
+            batch = hits[i:i + 500]
+            CACHE_DB.execute(
+                'UPDATE segment SET used = ? WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))), [used] + batch)
+
+# Evict the least recently used fields beyond the cache size
+def trimCache(db):
+    with db:
+        db.execute(
+            'DELETE FROM segment WHERE key IN (SELECT key FROM segment '
+            'ORDER BY used DESC LIMIT -1 OFFSET ?)', (CACHE_SIZE,))
+
+# Trim the segmentation cache file from the main process
+def trimCacheFile():
+    refreshCache()
+    db = connectCache(CACHE)
+    trimCache(db)
+    db.close()
+
+# Version string of a file from its path, size and modification time
+def fileVersion(filename):
+    if not os.path.exists(filename):
+        return filename
+    stat = os.stat(filename)
+    return '{} {} {}'.format(filename, stat.st_size, stat.st_mtime_ns)
+
+# Write a row of segmented word ids to spill file
+def writeSpill(sfd, label, field_ids):
+    label = label.encode('utf-8')
+    sfd.write(struct.pack('<II', len(label), len(field_ids)))
+    sfd.write(label)
+    for ids in field_ids:
+        sfd.write(struct.pack('<I', len(ids)))
+        sfd.write(ids.tobytes())
+
+# Read rows of segmented word ids from spill file
+def readSpill(sfd):
+    header = sfd.read(8)
+    while len(header) == 8:
+        label_length, field_count = struct.unpack('<II', header)
+        label = sfd.read(label_length).decode('utf-8')
+        field_ids = list()
+        for i in range(field_count):
+            ids = array.array('I')
+            ids.frombytes(sfd.read(ids.itemsize * struct.unpack(
+                '<I', sfd.read(4))[0]))
+            field_ids.append(ids)
+        yield label, field_ids
+        header = sfd.read(8)
@@ -0,0 +1,102 @@
+'''
+Sharded and compressed csv outputs with a manifest for the ingestion scripts
+Copyright 2016 Xiang Zhang
+
+Usage: import sharding; writer = sharding.ShardWriter(output, shards, compress)
+'''
+
+import collections
+import csv
+import gzip
+import json
+import lzma
+import os
+import zlib
+
+# Openers of compressed text files by compression name, with file suffixes
+COMPRESSORS = {'gzip': (gzip.open, '.gz'), 'xz': (lzma.open, '.xz')}
+
+# Writer of csv rows to one output file or to shards of it
+#
+# Without shards, the rows are written to the output file as before,
+# compressed if asked. With n shards, output 'p.csv' becomes p_00000.csv to
+# p_{n-1}.csv (with suffix .gz or .xz if compressed) and a manifest
+# p_manifest.json that has the rows, file size, uncompressed size and rows
+# per class (the first field) of each shard. A row goes to the shard given
+# by crc32 of its text fields joined by spaces, the same key as that of
+# remove_duplication.py, so that the shards are the same across reruns and
+# duplicated texts are always in the same shard.
+class ShardWriter:
+    def __init__(self, output, shards = None, compress = None):
+        self.output = output
+        self.shards = shards
+        self.compress = compress
+        if not shards:
+            self.filenames = [output]
+        else:
+            base, extension = os.path.splitext(output)
+            self.filenames = ['{}_{:05d}{}'.format(base, k, extension)
+                              for k in range(shards)]
+        if compress is not None:
+            self.filenames = [filename + COMPRESSORS[compress][1]
+                              for filename in self.filenames]
+        self.files = [self.openFile(filename) for filename in self.filenames]
+        self.writers = [csv.writer(
+            fd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+                        for fd in self.files]
+        self.rows = [0] * len(self.files)
+        self.classes = [collections.Counter() for fd in self.files]
+
+    def openFile(self, filename):
+        if self.compress is None:
+            return open(filename, 'w', newline = '', encoding = 'utf-8')
+        return COMPRESSORS[self.compress][0](
+            filename, 'wt', newline = '', encoding = 'utf-8')
+
+    def writerow(self, row):
+        if not self.shards:
+            self.writers[0].writerow(row)
+            return
+        k = zlib.crc32(' '.join(map(str, row[1:])).encode(
+            'utf-8')) % self.shards
+        self.writers[k].writerow(row)
+        self.rows[k] = self.rows[k] + 1
+        self.classes[k][str(row[0])] += 1
+
+    def writerows(self, rows):
+        if not self.shards:
+            self.writers[0].writerows(rows)
+            return
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        text_bytes = list()
+        for fd in self.files:
+            fd.flush()
+            # Position in the text is its size before compression
+            text_bytes.append(fd.buffer.tell())
+            fd.close()
+        if not self.shards:
+            return
+        shards = list()
+        for k in range(self.shards):
+            # Numeric class labels are sorted in numeric order
+            classes = sorted(self.classes[k].items(),
+                             key = lambda item: (len(item[0]), item[0]))
+            shards.append({'file': os.path.basename(self.filenames[k]),
+                           'rows': self.rows[k],
+                           'bytes': os.path.getsize(self.filenames[k]),
+                           'text_bytes': text_bytes[k],
+                           'classes': dict(classes)})
+        manifest = {'output': os.path.basename(self.output),
+                    'compress': self.compress,
+                    'key': 'crc32 of text fields joined by spaces',
+                    'rows': sum(self.rows), 'shards': shards}
+        fd = open(os.path.splitext(self.output)[0] + '_manifest.json', 'w',
+                  encoding = 'utf-8')
+        json.dump(manifest, fd, indent = 2)
+        fd.write('\n')
+        fd.close()
+        print('Shards: {}, rows per shard from {} to {}'.format(
+            len(shards), min(self.rows), max(self.rows)))
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+'''
+Shuffle lines in a text file larger than memory
+Copyright 2017 Xiang Zhang
+
+Usage: python3 shuffle_lines.py -i [input] -o [output] [-s seed]
+    [-b budget] [-w workers]
+'''
+
+#Input file
+INPUT = '../data/dianping/train_chartoken.txt'
+#Output file
+OUTPUT = '../data/dianping/train_chartoken_shuffle.txt'
+# Seed of random numbers
+SEED = 1
+# Memory budget of a process in megabytes
+BUDGET = 1024
+# Number of worker processes to shuffle buckets
+WORKERS = 1
+# Number of bytes of lines read to estimate the length of lines
+SAMPLE = 1048576
+# Number of bytes in memory for a line besides its text
+OVERHEAD = 56
+# Number of open files kept for other than buckets
+RESERVED_FILES = 32
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+
+# Main program
+def main():
+    global INPUT
+    global OUTPUT
+    global SEED
+    global BUDGET
+    global WORKERS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help = 'Input file', default = INPUT)
+    parser.add_argument(
+        '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-s', '--seed', help = 'Seed of random numbers', type = int,
+        default = SEED)
+    parser.add_argument(
+        '-b', '--budget', help = 'Memory budget of a process in megabytes',
+        type = int, default = BUDGET)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes', type = int,
+        default = WORKERS)
+
+    args = parser.parse_args()
+
+    INPUT = args.input
+    OUTPUT = args.output
+    SEED = args.seed
+    BUDGET = args.budget
+    WORKERS = args.workers
+
+    if BUDGET <= 0:
+        parser.error('argument -b/--budget: must be positive')
+    buckets, chunk = planBuckets()
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit != resource.RLIM_INFINITY and \
+       buckets > limit - RESERVED_FILES:
+        parser.error('argument -b/--budget: {} buckets needed, more than '
+                     'the limit of {} open files allows'.format(
+                         buckets, limit))
+
+    shuffleLines(buckets, chunk)
+
+# Plan the number of buckets and the bytes of lines read at a time
+#
+# The memory of lines is estimated from their length in the start of the
+# input and OVERHEAD per line. A bucket is expected to take half the budget
+# of a process, leaving room for buckets larger than expected, and lines
+# are read in chunks of a quarter of the budget when split. All buckets
+# are open while splitting, so their number is limited by open files.
+def planBuckets():
+    budget = BUDGET * 1048576
+    size = os.path.getsize(INPUT)
+    ifd = open(INPUT, 'rb')
+    sample = ifd.readlines(SAMPLE)
+    ifd.close()
+    # Bytes in memory per byte of text
+    ratio = 1 + OVERHEAD * len(sample) / max(sum(map(len, sample)), 1)
+    buckets = max(1, math.ceil(2 * size * ratio / budget))
+    chunk = max(1, int(budget / 4 / ratio))
+    return buckets, chunk
+
+# Shuffle lines through buckets on disk
+#
+# Each line goes to a bucket chosen uniformly at random, and each bucket is
+# shuffled in memory, so that every order of lines is equally likely. The
+# random numbers of a bucket depend only on the seed and the bucket, so
+# that the output is the same for the same seed and budget whatever the
+# number of workers. The buckets are put next to the output.
+def shuffleLines(buckets, chunk):
+    directory = tempfile.mkdtemp(
+        prefix = 'shuffle_lines_',
+        dir = os.path.dirname(os.path.abspath(OUTPUT)))
+    try:
+        n = splitLines(directory, buckets, chunk)
+        jobs = [(bucketFile(directory, k), SEED, k) for k in range(buckets)]
+        ofd = open(OUTPUT, 'wb')
+        if WORKERS <= 1:
+            for k, job in enumerate(jobs):
+                ofd.writelines(shuffleBucket(job))
+                print('\rShuffled buckets: {}/{}'.format(
+                    k + 1, buckets), end = '')
+        else:
+            pool = multiprocessing.Pool(WORKERS)
+            for k, filename in enumerate(pool.imap(shuffleFile, jobs)):
+                bfd = open(filename, 'rb')
+                shutil.copyfileobj(bfd, ofd)
+                bfd.close()
+                os.remove(filename)
+                print('\rShuffled buckets: {}/{}'.format(
+                    k + 1, buckets), end = '')
+            pool.close()
+            pool.join()
+        print('\nShuffled lines: {}'.format(n))
+        ofd.close()
+    finally:
+        shutil.rmtree(directory)
+
+# Write lines to buckets chosen at random
+def splitLines(directory, buckets, chunk):
+    generator = random.Random(SEED)
+    choices = range(buckets)
+    files = [open(bucketFile(directory, k), 'wb') for k in range(buckets)]
+    ifd = open(INPUT, 'rb')
+    n = 0
+    lines = ifd.readlines(chunk)
+    while lines:
+        # The last line may not end with a newline
+        if not lines[-1].endswith(b'\n'):
+            lines[-1] = lines[-1] + b'\n'
+        parts = [list() for k in range(buckets)]
+        for line, k in zip(lines, generator.choices(choices, k = len(lines))):
+            parts[k].append(line)
+        for k in range(buckets):
+            files[k].writelines(parts[k])
+        n = n + len(lines)
+        del parts
+        del lines
+        print('\rProcessing line: {}'.format(n), end = '')
+        lines = ifd.readlines(chunk)
+    print('\rProcessed lines: {}, buckets: {}'.format(n, buckets))
+    ifd.close()
+    for fd in files:
+        fd.close()
+    return n
+
+# Shuffle the lines of a bucket in memory
+def shuffleBucket(job):
+    filename, seed, k = job
+    fd = open(filename, 'rb')
+    lines = fd.readlines()
+    fd.close()
+    os.remove(filename)
+    random.Random('{}:{}'.format(seed, k)).shuffle(lines)
+    return lines
+
+# Shuffle the lines of a bucket to its file in a worker process
+def shuffleFile(job):
+    lines = shuffleBucket(job)
+    filename = job[0] + '.shuffled'
+    fd = open(filename, 'wb')
+    fd.writelines(lines)
+    fd.close()
+    return filename
+
+# Name of the file of a bucket in the temporary directory
+def bucketFile(directory, k):
+    return os.path.join(directory, 'bucket_{:05d}.txt'.format(k))
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,9 @@
 # Shuffle lines in a text file
 # Copyright 2017 Xiang Zhang
 #
-# Usage: bash shuffle_lines.sh [input] [output]
+# Usage: bash shuffle_lines.sh [input] [output] [seed]
 
 set -x;
 set -e;
 
-shuf $1 > $2;
+python3 "$(dirname $0)/shuffle_lines.py" -i $1 -o $2 -s ${3:-1};
@@ -0,0 +1,44 @@
+'''
+Cached transliteration of text to ascii for the romanization scripts
+Copyright 2016 Xiang Zhang
+
+Usage: import transliteration; transliteration.unidecode(text)
+'''
+
+# Maximum number of tokens in the token cache
+CACHE_SIZE = 1048576
+# Maximum length of tokens in the token cache
+TOKEN_LENGTH = 32
+
+import functools
+import unidecode as unidecode_module
+
+# Translation table from code points to ascii filled in on first use
+class Table(dict):
+    def __missing__(self, code):
+        self[code] = unidecode_module.unidecode(chr(code))
+        return self[code]
+
+# Translation table used by str.translate
+TABLE = Table()
+
+# Transliterate text to ascii with the same result as unidecode.unidecode
+def unidecode(text):
+    if text.isascii():
+        return text
+    if len(text) <= TOKEN_LENGTH:
+        return unidecodeToken(text)
+    return text.translate(TABLE)
+
+# Transliterate a token to ascii with the token cache
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def unidecodeToken(text):
+    return text.translate(TABLE)
+
+# Print the hit rate of the token cache
+def report():
+    info = unidecodeToken.cache_info()
+    total = info.hits + info.misses
+    print('Transliteration cache hits: {} of {} non-ascii tokens ({:.2f}%), '
+          'cached code points: {}'.format(
+              info.hits, total, 100.0 * info.hits / max(total, 1), len(TABLE)))
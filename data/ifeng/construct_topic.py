@@ -5,16 +5,23 @@ Create data from list of LZMA compressed archives of news articles
 Copyright 2016 Xiang Zhang
 
 Usage: python3 construct_topic.py -i [input directory] -o [output file]
+    [-w workers] [--shards shards]
+    [--compress method]
 '''
 
 import argparse
-import csv
 import glob
-import json
 import lzma
+import records
+import sharding
 
 INPUT = '../data/ifeng/article'
 OUTPUT = '../data/ifeng/topic/news.csv'
+WORKERS = 1
+SHARDS = None
+COMPRESS = None
+# Fields of articles decoded, with only the first paragraph of content
+FIELDS = {'title': None, 'content': 1}
 
 # Classes
 # 1: Mainlaind China Politics
@@ -27,50 +34,78 @@ CLASSES = {'11528': 1, '11574': 2, '11490': 3, '7609': 3, '4550': 4, '7837': 5}
 def main():
     global INPUT
     global OUTPUT
+    global WORKERS
+    global SHARDS
+    global COMPRESS
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-i', '--input', help = 'Input file pattern', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes', type = int,
+        default = WORKERS)
+    parser.add_argument(
+        '--shards', help = 'Number of output shards', type = int,
+        default = SHARDS)
+    parser.add_argument(
+        '--compress', help = 'Compression of output files',
+        choices = sorted(sharding.COMPRESSORS), default = COMPRESS)
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    WORKERS = args.workers
+    SHARDS = args.shards
+    COMPRESS = args.compress
 
     createData()
 
 def createData():
-    # Open the output file
-    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Grab the files
+    # Open the output file, or its shards
+    writer = sharding.ShardWriter(OUTPUT, SHARDS, COMPRESS)
+    # Grab the files in sorted order so that the output is deterministic
+    files = dict((prefix, sorted(glob.glob(
+        INPUT + '/' + prefix + '_*.json.xz'))) for prefix in CLASSES)
+    jobs = [(CLASSES[prefix], filename)
+            for prefix in CLASSES for filename in files[prefix]]
+    # Decompress and parse the files in worker processes if any, in order
+    results = records.readFiles(readRows, jobs, WORKERS)
     for prefix in CLASSES:
-        files = glob.glob(INPUT + '/' + prefix + '_*.json.xz')
-        index = CLASSES[prefix]
         n = 0
         filecount = 0
-        for filename in files:
+        for i in range(len(files[prefix])):
+            (index, filename), rows = next(results)
             filecount = filecount + 1
             print('Processing file {}/{}: {}. Processed items {}.'.format(
-                    filecount, len(files), filename, n))
+                    filecount, len(files[prefix]), filename, n))
             try:
-                ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
-                for line in ifd:
-                    news = json.loads(line)
-                    title = news.get('title', '')
-                    content = news.get('content', list())
-                    abstract = ''
-                    if len(content) > 0:
-                        abstract = content[0]
+                for row in rows:
+                    writer.writerow(row)
                     n = n + 1
-                    writer.writerow([index, title.replace('\n', '\\n'),
-                                     abstract.replace('\n', '\\n')])
-                ifd.close()
             except Exception as e:
                 print('Exception (ignored): {}'.format(e))
-    ofd.close()
+    # Finish the generator so that the worker processes are joined
+    for job in results:
+        pass
+    writer.close()
+
+# Read the rows of the file of a job
+def readRows(job):
+    index, filename = job
+    ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
+    for line in ifd:
+        news = records.loads(line, FIELDS)
+        title = news.get('title', '')
+        content = news.get('content', list())
+        abstract = ''
+        if len(content) > 0:
+            abstract = content[0]
+        yield [index, title.replace('\n', '\\n'),
+               abstract.replace('\n', '\\n')]
+    ifd.close()
 
 if __name__ == '__main__':
     main()
@@ -5,24 +5,30 @@ Create data from list of LZMA compressed archives of news articles
 Copyright 2016 Xiang Zhang
 
 Usage: python3 construct_topic.py -i [input directory] -o [output file]
+    [--shards shards] [--compress method]
 '''
 
 import argparse
 import csv
 import glob
-import json
 import lzma
 import re
+import records
+import sharding
 import urllib.parse
 
 INPUT = '../data/nytimes/article'
 OUTPUT = '../data/nytimes/topic/news.csv'
 CLASS = '../data/nytimes/topic/class.csv'
+SHARDS = None
+COMPRESS = None
 
 def main():
     global INPUT
     global OUTPUT
     global CLASS
+    global SHARDS
+    global COMPRESS
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -31,12 +37,20 @@ def main():
         '-o', '--output', help = 'Output file', default = OUTPUT)
     parser.add_argument(
         '-c', '--classes', help = 'Class file', default = CLASS)
+    parser.add_argument(
+        '--shards', help = 'Number of output shards', type = int,
+        default = SHARDS)
+    parser.add_argument(
+        '--compress', help = 'Compression of output files',
+        choices = sorted(sharding.COMPRESSORS), default = COMPRESS)
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
     CLASS = args.classes
+    SHARDS = args.shards
+    COMPRESS = args.compress
 
     createData()
 
@@ -44,9 +58,8 @@ def createData():
     # Open the category file
     classes = dict()
     count = 0
-    # Open the output file
-    ofd = open(OUTPUT, 'w', newline = '', encoding = 'utf-8')
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
+    # Open the output file, or its shards
+    writer = sharding.ShardWriter(OUTPUT, SHARDS, COMPRESS)
     # Grab the files
     files = glob.glob(INPUT + '/*.json.xz')
     n = 0
@@ -58,7 +71,7 @@ def createData():
         try:
             ifd = lzma.open(filename, 'rt', encoding = 'utf-8')
             for line in ifd:
-                news = json.loads(line)
+                news = records.loads(line)
                 title = news.get('title', '')
                 content = news.get('content', list())
                 abstract = ''
@@ -81,7 +94,7 @@ def createData():
             ifd.close()
         except Exception as e:
             print('Exception (ignored): {}'.format(e))
-    ofd.close()
+    writer.close()
     # Open the class file
     cfd = open(CLASS, 'w', newline = '', encoding = 'utf-8')
     class_writer = csv.writer(
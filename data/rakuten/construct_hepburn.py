@@ -4,76 +4,117 @@
 Convert Japanese datasets to Hepburn Romanization
 Copyright 2016 Xiang Zhang
 
-Usage: python3 construct_hepburn.py -i [input] -o [output]
+Usage: python3 construct_hepburn.py -i [input] -o [output] [-w workers]
+    [--resume]
 '''
 
 # Input file
 INPUT = '../data/rakuten/sentiment/full_train.csv'
 # Output file
 OUTPUT = '../data/rakuten/sentiment/full_train_hepburn.csv'
+# Maximum number of readings in the Hepburn cache
+CACHE_SIZE = 1048576
+# Number of worker processes
+WORKERS = 1
+# Resume from the checkpoint of output
+RESUME = False
 
 import argparse
-import csv
+import functools
 import MeCab
 import romkan
-import unidecode
+import runner
+import transliteration
 
 # Main program
 def main():
     global INPUT
     global OUTPUT
+    global WORKERS
+    global RESUME
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help = 'Input file', default = INPUT)
     parser.add_argument(
         '-o', '--output', help = 'Output file', default = OUTPUT)
+    parser.add_argument(
+        '-w', '--workers', help = 'Number of worker processes',
+        type = int, default = WORKERS)
+    parser.add_argument(
+        '--resume', help = 'Resume from checkpoint of output',
+        action = 'store_true')
 
     args = parser.parse_args()
 
     INPUT = args.input
     OUTPUT = args.output
+    WORKERS = args.workers
+    RESUME = args.resume
 
-    mecab = MeCab.Tagger()
-
-    convertRoman(mecab)
+    convertRoman()
 
+# Romanize the readings of the words in text, or keep the words without one
 def romanizeText(mecab, text):
-    parsed = mecab.parse(text)
+    return analyzeText(mecab, text)[1]
+
+# Analyze text to its words and their romanized readings
+def analyzeText(mecab, text):
+    words = list()
     result = list()
-    for token in parsed.split('\n'):
-        splitted = token.split('\t')
-        if len(splitted) == 2:
-            word = splitted[0]
-            features = splitted[1].split(',')
+    node = mecab.parseToNode(text)
+    while node:
+        # Skip the beginning and end of sentence nodes
+        if node.stat < 2:
+            words.append(node.surface)
+            # The reading is the 8th feature
+            features = node.feature.split(',', 8)
             if len(features) > 7 and features[7] != '*':
-                result.append(romkan.to_hepburn(features[7]))
+                result.append(romanizeReading(features[7]))
             else:
-                result.append(word)
-    return result
+                result.append(node.surface)
+        node = node.next
+    return words, result
+
+# Romanize a katakana reading with the Hepburn cache
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def romanizeReading(reading):
+    return romkan.to_hepburn(reading)
 
 # Convert the text in Chinese to pintin
-def convertRoman(mecab):
-    # Open the files
-    ifd = open(INPUT, encoding = 'utf-8', newline = '')
-    ofd = open(OUTPUT, 'w', encoding = 'utf-8', newline = '')
-    reader = csv.reader(ifd, quoting = csv.QUOTE_ALL)
-    writer = csv.writer(ofd, quoting = csv.QUOTE_ALL, lineterminator = '\n')
-    # Loop over the csv rows
-    n = 0
-    for row in reader:
-        new_row = list()
-        new_row.append(row[0])
-        for i in range(1, len(row)):
-            new_row.append(' '.join(map(
-                str.strip,
-                map(lambda s: s.replace('\n', '\\n'),
-                    map(unidecode.unidecode,
-                        romanizeText(mecab, row[i]))))))
-        writer.writerow(new_row)
-        n = n + 1
-        if n % 1000 == 0:
-            print('\rProcessing line: {}'.format(n), end = '')
-    print('\rProcessed lines: {}'.format(n))
+def convertRoman():
+    runner.run(INPUT, OUTPUT, createConverter, WORKERS, RESUME)
+    # Caches of worker processes are not reported
+    if WORKERS <= 1:
+        info = romanizeReading.cache_info()
+        print('Hepburn cache hits: {} of {} readings ({:.2f}%)'.format(
+            info.hits, info.hits + info.misses,
+            100.0 * info.hits / max(info.hits + info.misses, 1)))
+        transliteration.report()
+
+# Create the row converter in a process
+def createConverter():
+    mecab = MeCab.Tagger()
+    return functools.partial(convertRow, mecab)
+
+# Convert a csv row with text in Japanese to Hepburn romanization
+def convertRow(mecab, row):
+    new_row = list()
+    new_row.append(row[0])
+    for i in range(1, len(row)):
+        new_row.append(convertTokens(romanizeText(mecab, row[i])))
+    return new_row
+
+# Convert romanized tokens to an ascii text field
+def convertTokens(tokens):
+    return ' '.join(map(
+        str.strip,
+        map(lambda s: s.replace('\n', '\\n'),
+            map(transliteration.unidecode, tokens))))
+
+# Create the Hepburn view of text fields for segment_word.py
+def createView():
+    mecab = MeCab.Tagger()
+    return lambda text: convertTokens(romanizeText(mecab, text))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1 @@
+../dianping/transliteration.py
\ No newline at end of file